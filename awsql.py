@@ -5,6 +5,13 @@ import json
 import argparse
 import sys
 import collections
+import threading
+import os
+import glob
+import time
+import queue
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from multiprocessing.pool import ThreadPool
 from botocore.exceptions import ClientError
 
@@ -27,50 +34,89 @@ def get_all_regions():
         "sa-east-1",
     ]
 
-def get_sessions_for_roles(roles):
-    client = boto3.client('sts')
+def get_role_credentials(client, role, cache=None):
+    """Returns the STS credentials of a role, or None if it can't be assumed."""
+    credentials = cache.get(role) if cache is not None else None
 
-    for ro in roles:
+    if credentials is None:
         try:
             response = client.assume_role(
-                RoleArn=ro,
+                RoleArn=role,
                 RoleSessionName="AWSQL"
             )
         except ClientError as e:
-            sys.stderr.write("Cannot assume role: {0}\n".format(ro))
+            sys.stderr.write("Cannot assume role: {0}\n".format(role))
             sys.stderr.write("-> Reason: {0}\n".format(str(e)))
-            continue
+            return None
         except Exception as e:
             sys.stderr.write("Error: {0}\n".format(str(e)))
+            return None
 
         credentials = response["Credentials"]
-        yield (boto3.Session(
-            aws_access_key_id=credentials['AccessKeyId'],
-            aws_secret_access_key=credentials['SecretAccessKey'],
-            aws_session_token=credentials['SessionToken']), ro.split(':')[4])
+        if cache is not None:
+            cache.put(role, credentials)
+
+    return credentials
+
+def role_session(role, credentials):
+    """Returns a session with the credentials of a role, and its account id."""
+    return (boto3.Session(
+        aws_access_key_id=credentials['AccessKeyId'],
+        aws_secret_access_key=credentials['SecretAccessKey'],
+        aws_session_token=credentials['SessionToken']), role.split(':')[4])
 
-    raise StopIteration()
+def assume_role(client, role, cache=None):
+    """Returns a session with the credentials of a role and its account id, or None if it can't be assumed."""
+    credentials = get_role_credentials(client, role, cache)
+    if credentials is None:
+        return None
+
+    return role_session(role, credentials)
 
 class InterpreterRunParameters(object):
-    def __init__(self, interpreter, session, regions, account_id, with_identity, with_alias):
+    # The options following with_alias are keyword only, so that adding one doesn't shift the others
+    def __init__(self, interpreter, session, regions, account_id, with_identity, with_alias, *, dependencies=None, conditions=None, archive=None, profile=False, snapshots=None, scheduler=None, clients=None, projections=None, processes=None, source=None):
         self.interpreter = interpreter
+        self.prefetched = {}
+        self.processes = processes
+        self.source = source
+        self.projections = projections
+        self.clients = clients
+        self.snapshots = snapshots
+        self.scheduler = scheduler
+        self.profile = profile
+        self.timings = {}
+        self.archive = archive
+        self.dependencies = dependencies
+        self.conditions = conditions
         self.session = session
         self.regions = regions
         self.account_id = account_id
         self.with_alias = with_alias
         self.with_identity = with_identity
+        self.lock = threading.Lock()
+        self.meta = {}
+        self.global_collections = None
 
-def run_with_params(rp: InterpreterRunParameters):
-    results = []
-    acc = {}
-    meta = {}
+def prepare_account(rp: InterpreterRunParameters):
+    """Resolves the account metadata and the global collections shared by all the regions of an account."""
+    start = time.perf_counter()
+    rp.meta = {}
+
+    # The clients are shared by the regions of the account, and by the runs using the same pool
+    if rp.clients is not None and rp.session is not None:
+        rp.session = rp.clients.session(rp.session)
+
+    # The API calls of the account are recorded to, or replayed from the archive
+    if rp.archive is not None:
+        rp.session = rp.archive.session(rp.session, rp.account_id or "default")
 
     # Get the AWS Account Alias
     if rp.with_alias:
         try:
             aliases = rp.session.client("iam").list_account_aliases()
             if len(aliases["AccountAliases"]) > 0:
-                meta["alias"] = aliases["AccountAliases"][0]
+                rp.meta["alias"] = aliases["AccountAliases"][0]
         except Exception:
             pass
 
@@ -81,46 +127,306 @@ def run_with_params(rp: InterpreterRunParameters):
             rp.account_id = identity["Account"]
 
             if rp.with_identity:
-                meta["identity"] = identity["Arn"]
+                rp.meta["identity"] = identity["Arn"]
         except Exception:
             pass
-            
-    # Loop through all the regions and execute the query
+
+    # Global collections are fetched once and shared by every region
+    rp.global_collections = awssource.get_global_collections(rp.session, rp.regions[0], rp.dependencies)
+    # Without an account id the entries could be mixed between accounts
+    if rp.snapshots is not None and rp.account_id is not None:
+        awssource.use_snapshot_cache(rp.global_collections, rp.snapshots, rp.account_id, "global")
+    if rp.scheduler is not None:
+        awssource.use_scheduler(rp.global_collections, rp.scheduler, rp.account_id, "global")
+    if rp.projections is not None:
+        awssource.use_projections(rp.global_collections, rp.projections)
+    rp.timings["prepare_account"] = time.perf_counter() - start
+
+    return rp
+
+def get_region_collections(rp: InterpreterRunParameters, rg):
+    # The collections created, and started, ahead by prefetch_regions
+    local_vars = rp.prefetched.pop(rg, None)
+    if local_vars is not None:
+        return local_vars
+
+    # boto3 sessions are not thread safe, the clients created from them are
+    with rp.lock:
+        local_vars = awssource.get_all_collections(rp.session, rg, rp.dependencies, rp.global_collections, rp.conditions)
+
+    # The collections of the global services are shared with the other regions, and set up by prepare_account
+    regional = {k: v for k, v in local_vars.items() if not awssource.is_global(k)}
+    if rp.snapshots is not None and rp.account_id is not None:
+        awssource.use_snapshot_cache(regional, rp.snapshots, rp.account_id, rg)
+    if rp.scheduler is not None:
+        awssource.use_scheduler(regional, rp.scheduler, rp.account_id, rg)
+    if rp.projections is not None:
+        awssource.use_projections(regional, rp.projections)
+
+    return local_vars
+
+def prefetch_regions(rp: InterpreterRunParameters):
+    """Creates the collections of every region of an account and starts fetching them, with the async engine."""
     for rg in rp.regions:
-        local_vars = awssource.get_all_collections(rp.session, rg)
+        local_vars = get_region_collections(rp, rg)
+        awssource.prefetch_collections(local_vars, rp.dependencies)
+        rp.prefetched[rg] = local_vars
+
+def run_region(rp: InterpreterRunParameters, rg):
+    """Executes the query in one region of an account prepared with prepare_account."""
+
+    profile = {}
+    try:
+        start = time.perf_counter()
+        local_vars = get_region_collections(rp, rg)
+
         local_vars["account"] = {
             "id": rp.account_id,
             "region": rg
         }
         context = parser.Context(local_vars)
+        profile["setup"] = time.perf_counter() - start
 
-        try:
-            result = {"result": rp.interpreter.run(context)}
-        except Exception as e:
-            result = {"error": str(e)}
+        steps = [] if rp.profile else None
+        result = {"result": rp.interpreter.run(context, steps)}
+
+        profile["steps"] = steps
+        profile["collections"] = get_collection_stats(local_vars)
+        if rp.scheduler is not None:
+            profile["limits"] = rp.scheduler.stats(rp.account_id, rg)
+    except Exception as e:
+        result = {"error": str(e)}
+
+    if rp.profile:
+        result["profile"] = profile
+
+    return {"region": rg, **result}
+
+def get_collection_stats(local_vars):
+    """Returns the fetch statistics of the collections of a region. Global collections are shared by the regions."""
+    stats = {}
+    for service, collections in local_vars.items():
+        if service not in awssource.COLLECTIONS:
+            continue
+
+        for name, coll in collections.items():
+            if hasattr(coll, "stats"):
+                stats["{0}.{1}".format(service, name)] = {**coll.stats, "global": awssource.is_global(service)}
+
+    return stats
+
+def fetch_region(rp: InterpreterRunParameters, rg):
+    """Fetches the collections used by the query in one region of an account prepared with prepare_account."""
+
+    try:
+        local_vars = get_region_collections(rp, rg)
+
+        for path in rp.dependencies:
+            coll = parser.Context(local_vars).var(path)
+            if isinstance(coll, awssource.utils.LazyList):
+                coll.keep = True
+                coll.fetch()
+    except Exception as e:
+        return {"region": rg, "error": str(e)}
+
+    return {"region": rg, "collections": local_vars}
+
+def plain_collections(value):
+    """Replaces the LazyLists found in a variable (ie. a collection, or a whole service) by their data."""
+    if isinstance(value, awssource.utils.LazyList):
+        return value.fetch().data
+    elif isinstance(value, dict):
+        return {k: plain_collections(v) for k, v in value.items()}
+
+    return value
+
+def run_region_process(rp: InterpreterRunParameters, rg):
+    """Fetches the collections of a region on the calling thread, and evaluates the query in the rp.processes pool."""
+    profile = {}
+    try:
+        start = time.perf_counter()
+        fetched = fetch_region(rp, rg)
+        if "error" in fetched:
+            return fetched
+
+        # Only the data of the collections used by the query is sent
+        local_vars = fetched["collections"]
+        data = {"account": {"id": rp.account_id, "region": rg}}
+        for path in rp.dependencies:
+            coll = plain_collections(parser.Context(local_vars).var(path))
+
+            parts = path.split(".")
+            target = data
+            for k in parts[:-1]:
+                target = target.setdefault(k, {})
+
+            target[parts[-1]] = coll
+
+        payload = parser.evaluation.dump_collections(data)
+        profile["setup"] = time.perf_counter() - start
+        profile["payload_bytes"] = len(payload)
+
+        output = rp.processes.submit(parser.evaluation.evaluate, rp.source, payload, rp.profile).result()
+        result = {k: v for k, v in output.items() if k != "steps"}
 
-        results.append({"region": rg, **result})
+        profile["steps"] = output.get("steps")
+        profile["collections"] = get_collection_stats(local_vars)
+        if rp.scheduler is not None:
+            profile["limits"] = rp.scheduler.stats(rp.account_id, rg)
+    except Exception as e:
+        result = {"error": str(e)}
 
+    if rp.profile:
+        result["profile"] = profile
+
+    return {"region": rg, **result}
+
+def merge_collections(dependencies, fetched):
+    """Merges the collections fetched in every (account, region) into a single partitioned collection per path.
+
+    Collections of global services are only added once per account, in the "global" region."""
+    merged = {}
+    seen = set()
+
+    for task, result in fetched:
+        if "collections" not in result:
+            continue
+
+        for path in dependencies:
+            parts = path.split(".")
+            if len(parts) != 2 or parts[0] not in result["collections"]:
+                continue
+
+            region = result["region"]
+            if awssource.is_global(parts[0]):
+                if (id(task), path) in seen:
+                    continue
+
+                seen.add((id(task), path))
+                region = "global"
+
+            coll = result["collections"][parts[0]].get(parts[1])
+            if coll is None:
+                continue
+
+            target = merged.setdefault(parts[0], {}).setdefault(parts[1], awssource.utils.PartitionedList())
+            target.keep = dependencies[path] > 1
+            target.add({"id": task.account_id, "region": region}, coll)
+
+    return merged
+
+def split_batch_results(output, names):
+    """Splits the output of a batch run, where each region result holds {name: {result|error}}, into one output per query."""
+    split = {}
+    for name in names:
+        accounts = []
+        for acc in output:
+            regions = []
+            for rg in acc["regions"]:
+                if "result" in rg:
+                    regions.append({"region": rg["region"], **rg["result"][name]})
+                else:
+                    regions.append(rg)
+
+            accounts.append({**acc, "regions": regions})
+
+        split[name] = accounts
+
+    return split
+
+def read_queries(paths):
+    """Reads the queries of the given files and directories (*.awsql files) as {name: content}."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.awsql"))))
+        else:
+            files.append(path)
+
+    queries = {}
+    for filename in files:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        if name in queries:
+            name = filename
+
+        with open(filename) as fp:
+            queries[name] = fp.read()
+
+    return queries
+
+def make_account_result(rp: InterpreterRunParameters, results):
     acc = {"account": rp.account_id, "regions": results}
 
-    if meta:
-        acc["meta"] = meta
+    if rp.meta:
+        acc["meta"] = rp.meta
+
+    if rp.profile:
+        acc["profile"] = rp.timings
+        if rp.scheduler is not None:
+            acc["profile"]["limits"] = rp.scheduler.stats(rp.account_id)
 
     return acc
 
+def run_with_params(rp: InterpreterRunParameters):
+    prepare_account(rp)
+
+    # Loop through all the regions and execute the query
+    results = [run_region(rp, rg) for rg in rp.regions]
+
+    return make_account_result(rp, results)
+
 class AWSQLInterpreter():
-    def __init__(self, with_identity=False, with_alias=False):
+    def __init__(self, with_identity=False, with_alias=False, archive=None, profile=False, snapshots=None, sessions=None, pools=None, scheduler=None, clients=None, processes=None, engine=None):
+        """sessions, pools, scheduler and clients are given by long running processes to reuse their sessions, worker pools, learned limits and clients.
+
+        With a processes pool (concurrent.futures), the queries are evaluated in the pool while the fetches stay on the threads.
+        With an awssource.aio.AsyncEngine, the roles are assumed and the collections fetched as coroutines."""
+        self.snapshots = snapshots
+        self.engine = engine
+        self.processes = processes
+        self.clients = clients if clients is not None else awssource.clients.ClientPool()
+        self.scheduler = scheduler
+        self.sessions = sessions
+        self.pools = pools
         self.with_identity = with_identity
         self.with_alias = with_alias
-        pass
+        self.archive = archive
+        self.profile = profile
 
     def load(self, content):
+        self.source = content
         p = parser.Parser(content)
         steps = p.parse()
         self.interpreter = parser.BaseInterpreter(steps)
+        self.dependencies = self.interpreter.dependencies()
+        self.conditions = self.interpreter.conditions()
+        self.projections = self.interpreter.projections()
+
+    def load_batch(self, queries):
+        """Loads several queries, given as {name: content}, to run them against the same collections."""
+        self.source = tuple(queries.items())
+        self.interpreter = parser.QueryBatch({name: parser.BaseInterpreter(parser.Parser(content).parse()) for name, content in queries.items()})
+        self.dependencies = self.interpreter.dependencies()
+        self.conditions = self.interpreter.conditions()
+        self.projections = self.interpreter.projections()
+
+    def explain(self):
+        return self.interpreter.explain()
 
     def new_run_params(self, session, regions, account_id=None):
-        return InterpreterRunParameters(self.interpreter, session, regions, account_id, self.with_identity, self.with_alias)
+        return InterpreterRunParameters(
+            self.interpreter, session, regions, account_id, self.with_identity, self.with_alias,
+            dependencies=self.dependencies,
+            conditions=self.conditions,
+            archive=self.archive,
+            profile=self.profile,
+            snapshots=self.snapshots,
+            scheduler=self.scheduler,
+            # The async engine has clients of its own
+            clients=self.clients if self.engine is None else None,
+            projections=self.projections,
+            processes=self.processes,
+            source=self.source)
 
     def create_worker_pool(self, tasks, workers):
         num_tasks = len(tasks)
@@ -136,34 +442,206 @@ class AWSQLInterpreter():
             num_tasks -= workers
             i += 1
 
-    def run(self, regions, roles=None, workers=False):
-        if roles is None:
-            sess = boto3.Session()
-            tasks = [self.new_run_params(boto3.Session(), regions)]
-        else:
-            tasks = [self.new_run_params(x[0], regions, x[1]) for x in get_sessions_for_roles(roles)]
-
+    def stream(self, regions, roles=None, workers=False, credentials_cache=None, region_func=run_region):
+        """Yields (account index, run parameters, region index, region result) as soon as each region completes."""
         if not workers:
             workers = 1
 
-        pool = ThreadPool(workers)
-        output = pool.map(run_with_params, tasks)
+        if self.processes is not None and region_func is run_region:
+            region_func = run_region_process
+
+        replay = self.archive is not None and self.archive.replay
+        sessions = self.sessions
+        if sessions is None and self.engine is not None and not replay:
+            sessions = self.engine.sessions(roles, credentials_cache)
+
+        sts = boto3.client('sts') if roles is not None and not replay and sessions is None else None
+        done = queue.Queue()
+        submitted = [0]
+        lock = threading.Lock()
+
+        def start_account(item):
+            idx, role = item
+            start = time.perf_counter()
+
+            if replay:
+                # Replayed accounts don't need credentials
+                sess = (None, role.split(':')[4] if role is not None else None)
+            elif sessions is not None:
+                sess = sessions.get(role)
+                if sess is None:
+                    return
+            elif role is None:
+                sess = (boto3.Session(), None)
+            else:
+                sess = assume_role(sts, role, credentials_cache)
+                if sess is None:
+                    return
+
+            try:
+                task = self.new_run_params(sess[0], regions, sess[1])
+                task.timings["assume_role"] = time.perf_counter() - start
+                prepare_account(task)
+
+                # The regions are all fetched at once, the workers only wait for the pages
+                if self.engine is not None:
+                    prefetch_regions(task)
+            except Exception as e:
+                sys.stderr.write("Error: {0}\n".format(str(e)))
+                return
+
+            for rg_idx, rg in enumerate(task.regions):
+                with lock:
+                    submitted[0] += 1
+
+                # A region whose function fails still has to be received, or the loop below would wait for it forever
+                pool.apply_async(region_func, (task, rg),
+                    callback=lambda r, rg_idx=rg_idx: done.put((idx, task, rg_idx, r)),
+                    error_callback=lambda e, rg_idx=rg_idx, rg=rg: done.put((idx, task, rg_idx, {"region": rg, "error": str(e)})))
+
+        # Roles are assumed concurrently on their own pool while the queries run on the
+        # main one, so that the regions of an account are queued as soon as its credentials
+        # are available. Every (account, region) pair is a work unit of the same pool, so
+        # that a single account with many regions still uses all the workers.
+        if self.pools is not None:
+            accounts_pool, pool = self.pools
+        else:
+            accounts_pool, pool = ThreadPool(workers), ThreadPool(workers)
+
+        try:
+            accounts_pool.map_async(start_account, enumerate(roles or [None]), callback=lambda _: done.put(None), error_callback=lambda _: done.put(None))
+
+            # The None marker arrives once every account has submitted its regions
+            received = 0
+            started = False
+            while not started or received < submitted[0]:
+                item = done.get()
+                if item is None:
+                    started = True
+                    continue
+
+                received += 1
+                yield item
+        finally:
+            if self.pools is None:
+                accounts_pool.close()
+                pool.close()
+
+    def run(self, regions, roles=None, workers=False, credentials_cache=None):
+        accounts = {}
+        for idx, task, rg_idx, result in self.stream(regions, roles, workers, credentials_cache):
+            accounts.setdefault(idx, (task, {}))[1][rg_idx] = result
+
+        return [make_account_result(t, [r[x] for x in sorted(r)]) for _, (t, r) in sorted(accounts.items(), key=lambda x: x[0])]
+
+    def run_merged(self, regions, roles=None, workers=False, credentials_cache=None):
+        """Fetches every (account, region) in parallel and runs the query once over the merged collections.
+
+        The items are tagged with their "account" ({id, region}) so they can be filtered, joined or grouped on."""
+        fetched = []
+        errors = []
+        for idx, task, rg_idx, result in self.stream(regions, roles, workers, credentials_cache, fetch_region):
+            if "error" in result:
+                errors.append({"account": task.account_id, "region": result["region"], "error": result["error"]})
+            else:
+                fetched.append(((idx, rg_idx), task, result))
+
+        fetched.sort(key=lambda x: x[0])
+        merged = merge_collections(self.dependencies, [(t, r) for _, t, r in fetched])
+
+        steps = [] if self.profile else None
+        try:
+            output = {"result": self.interpreter.run(parser.Context(merged), steps)}
+        except Exception as e:
+            output = {"error": str(e)}
+
+        if self.profile:
+            output["profile"] = {"steps": steps, "partitions": [
+                {"account": t.account_id, "region": r["region"], "collections": get_collection_stats(r["collections"])} for _, t, r in fetched
+            ]}
+
+            if self.scheduler is not None:
+                output["profile"]["limits"] = self.scheduler.stats()
+
+        if errors:
+            output["errors"] = errors
 
         return output
 
 def main():
     p = argparse.ArgumentParser()
-    p.add_argument("input", action="store")
+    p.add_argument("input", action="store", nargs="*", help="Query files, or directories of *.awsql files")
+    p.add_argument("--output-dir", dest="output_dir", action="store", help="Writes the results of each query to <name>.json")
     p.add_argument("--regions", dest="regions", action="store")
     p.add_argument("--roles", dest="roles", action="store")
     p.add_argument("--with-alias", dest="with_alias", action="store_true")
     p.add_argument("--with-identity", dest="with_identity", action="store_true")
+    p.add_argument("--credentials-cache", dest="credentials_cache", action="store", nargs="?", const=awssource.credentials.DEFAULT_CACHE_PATH)
+    p.add_argument("--merge", dest="merge", action="store_true")
+    p.add_argument("--profile", dest="profile", action="store_true")
+    p.add_argument("--explain", dest="explain", action="store_true")
+    g = p.add_mutually_exclusive_group()
+    g.add_argument("--record", dest="record", action="store")
+    g.add_argument("--replay", dest="replay", action="store")
+    p.add_argument("--cache", dest="cache", action="store", nargs="?", const=awssource.cache.DEFAULT_CACHE_PATH)
+    p.add_argument("--cache-ttl", dest="cache_ttl", action="store", default="300")
+    p.add_argument("--cache-size", dest="cache_size", type=int, action="store", default=512)
+    p.add_argument("--refresh", dest="refresh", action="store_true")
+    p.add_argument("--format", dest="format", action="store", choices=["json", "ndjson"], default="json")
+    p.add_argument("--no-scheduler", dest="scheduler", action="store_false", help="Disables the adaptive limits of the API calls")
+    p.add_argument("--backend", dest="backend", action="store", choices=["thread", "process"], default="thread", help="Evaluates the queries on the worker threads, or in a process pool")
+    p.add_argument("--processes", dest="processes", type=int, action="store", help="Size of the process pool of the process backend")
+    p.add_argument("--fetch", dest="fetch", action="store", choices=["thread", "async"], default="thread", help="Fetches the collections on the worker threads, or as coroutines (requires aiobotocore)")
     p.add_argument("-w", "--workers", dest="workers", type=int, action="store", default=False)
+    p.add_argument("--serve", dest="serve", action="store", metavar="[HOST:]PORT", help="Runs the queries posted to http://HOST:PORT/query")
 
     args = p.parse_args()
+    if not args.input and args.serve is None:
+        p.error("the following arguments are required: input")
+
+    if args.fetch == "async" and not awssource.aio.AVAILABLE:
+        p.error("--fetch async requires the aiobotocore package")
+
+    archive = None
+    if args.record:
+        archive = awssource.recording.Archive(args.record)
+    elif args.replay:
+        archive = awssource.recording.Archive(args.replay, replay=True)
+
+    cache = None
+    if args.credentials_cache:
+        cache = awssource.credentials.CredentialCache(args.credentials_cache)
+
+    if args.serve is not None:
+        import server
+
+        host, _, port = args.serve.rpartition(":")
+        ttl, ttls = awssource.cache.parse_ttls(args.cache_ttl)
+        server.serve((host or "127.0.0.1", int(port)), args.workers or 8, ttl if ttl is not None else 300, ttls, cache, archive)
+        return
+
+    queries = read_queries(args.input)
+    batch = len(args.input) > 1 or os.path.isdir(args.input[0])
+
+    snapshots = None
+    if args.cache:
+        ttl, ttls = awssource.cache.parse_ttls(args.cache_ttl)
+        snapshots = awssource.cache.SnapshotCache(args.cache, ttl if ttl is not None else 300, ttls, args.cache_size * 2**20, args.refresh)
+
+    # Replayed calls aren't throttled, and the async engine limits the calls in flight itself
+    scheduler = None
+    if args.scheduler and not args.replay and args.fetch != "async":
+        scheduler = awssource.throttling.Scheduler()
+
+    interpreter = AWSQLInterpreter(with_alias=args.with_alias, with_identity=args.with_identity, archive=archive, profile=args.profile, snapshots=snapshots, scheduler=scheduler)
+    if batch:
+        interpreter.load_batch(queries)
+    else:
+        interpreter.load(list(queries.values())[0])
 
-    with open(args.input) as fp:
-        cfg = fp.read()
+    if args.explain:
+        print(json.dumps(interpreter.explain(), indent=2))
+        return
 
     if args.regions is None:
         regions = [boto3.Session().region_name]
@@ -177,11 +655,86 @@ def main():
         with open(args.roles) as fp:
             roles = [x.strip() for x in fp.readlines()]
 
-    interpreter = AWSQLInterpreter(with_alias=args.with_alias, with_identity=args.with_identity)
-    interpreter.load(cfg)
-
-    results = list(interpreter.run(regions, roles=roles, workers=args.workers))
-    print(json.dumps(results, indent=2))   
+    # The processes are spawned rather than forked from a process running threads
+    if args.backend == "process":
+        interpreter.processes = ProcessPoolExecutor(args.processes, mp_context=multiprocessing.get_context("spawn"))
+
+    if args.fetch == "async" and not args.replay:
+        interpreter.engine = awssource.aio.AsyncEngine()
+
+    try:
+        if args.merge:
+            # All the accounts and regions are queried as a single collection
+            output = interpreter.run_merged(regions, roles=roles, workers=args.workers, credentials_cache=cache)
+            if batch:
+                shared = {k: v for k, v in output.items() if k != "result"}
+                output = {name: {**shared, **output.get("result", {}).get(name, {})} for name in queries}
+
+            write_output(args.output_dir, output, batch)
+        elif args.format == "ndjson":
+            outputs = {}
+
+            try:
+                # One line per account/region, written as soon as it completes
+                for _, task, _, result in interpreter.stream(regions, roles=roles, workers=args.workers, credentials_cache=cache):
+                    line = {"account": task.account_id, **result}
+                    if task.meta:
+                        line["meta"] = task.meta
+
+                    if task.profile:
+                        line["account_profile"] = task.timings
+
+                    if not batch:
+                        write_line(outputs, args.output_dir, None, line)
+                    elif "result" not in line:
+                        for name in queries:
+                            write_line(outputs, args.output_dir, name, line)
+                    else:
+                        for name, r in line.pop("result").items():
+                            write_line(outputs, args.output_dir, name, {**line, **r})
+            finally:
+                for fp in outputs.values():
+                    fp.close()
+        else:
+            results = list(interpreter.run(regions, roles=roles, workers=args.workers, credentials_cache=cache))
+            if batch:
+                results = split_batch_results(results, queries)
+
+            write_output(args.output_dir, results, batch)
+    finally:
+        if interpreter.processes is not None:
+            interpreter.processes.shutdown()
+
+        if interpreter.engine is not None:
+            interpreter.engine.close()
+
+def write_output(output_dir, output, batch):
+    """Prints the output, or writes the output of each query of a batch to output_dir/<name>.json."""
+    if output_dir is None:
+        print(json.dumps(output, indent=2, default=str))
+        return
+
+    os.makedirs(output_dir, exist_ok=True)
+    for name, value in (output.items() if batch else [("result", output)]):
+        with open(os.path.join(output_dir, "{0}.json".format(name)), "w") as fp:
+            json.dump(value, fp, indent=2, default=str)
+
+def write_line(outputs, output_dir, name, line):
+    """Writes an NDJSON line to stdout, or to output_dir/<name>.ndjson."""
+    if output_dir is None:
+        if name is not None:
+            line = {"query": name, **line}
+
+        sys.stdout.write(json.dumps(line, default=str) + "\n")
+        sys.stdout.flush()
+        return
+
+    if name not in outputs:
+        os.makedirs(output_dir, exist_ok=True)
+        outputs[name] = open(os.path.join(output_dir, "{0}.ndjson".format(name or "result")), "w")
+
+    outputs[name].write(json.dumps(line, default=str) + "\n")
+    outputs[name].flush()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
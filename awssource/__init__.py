@@ -1,4 +1,4 @@
-from . import ec2, s3, r53, rds, iam
+from . import ec2, s3, r53, rds, iam, credentials, recording, cache, throttling, clients, aio
 
 COLLECTIONS = {
     "ec2": ec2,
@@ -8,9 +8,112 @@ COLLECTIONS = {
     "iam": iam,
 }
 
-def get_all_collections(session, region):
+def get_required_collections(paths):
+    """Maps the collection paths referenced by a query (ie. ec2.instances) to {service: {collection names}}."""
+    required = {}
+    for p in paths:
+        parts = p.split(".")
+        if parts[0] not in COLLECTIONS:
+            continue
+
+        names = required.setdefault(parts[0], set())
+        if len(parts) > 1:
+            names.add(parts[1])
+        else:
+            names.update(COLLECTIONS[parts[0]].COLLECTIONS)
+
+    return required
+
+def is_global(service):
+    """Global services (IAM, S3 buckets, Route53) return the same data whatever the region of the client."""
+    return COLLECTIONS[service].GLOBAL
+
+def get_global_collections(session, region, dependencies=None):
+    """Creates the collections of the global services once, to be shared by all the regions of a session."""
+    if dependencies is None:
+        required = {c: None for c in COLLECTIONS}
+    else:
+        required = get_required_collections(dependencies)
+
+    output = {}
+    for c, names in required.items():
+        if is_global(c):
+            output[c] = COLLECTIONS[c].get_collections(session, session.client(c, region_name=region), names)
+
+    return output
+
+def get_service_conditions(conditions, service):
+    """Picks the {collection name: {field: value}} conditions of a service in the {path: {field: value}} conditions of a query."""
     output = {}
-    for c in COLLECTIONS:
-        output[c] = COLLECTIONS[c].get_collections(session, session.client(c, region_name=region))
+    for path, fields in (conditions or {}).items():
+        parts = path.split(".")
+        if len(parts) == 2 and parts[0] == service:
+            output[parts[1]] = fields
 
     return output
+
+def get_all_collections(session, region, dependencies=None, global_collections=None, conditions=None):
+    """Creates the collections of a region, only for the services and collections in dependencies if given.
+
+    Services found in global_collections are reused as is instead of being fetched again for this region.
+    When dependencies maps the paths to their number of uses, the collections used only once are streamed.
+    The equality conditions of the query on the collections are given to the services supporting server side filters."""
+    if dependencies is None:
+        required = {c: None for c in COLLECTIONS}
+    else:
+        required = get_required_collections(dependencies)
+
+    output = {}
+    for c, names in required.items():
+        if global_collections is not None and c in global_collections:
+            output[c] = global_collections[c]
+        else:
+            client = session.client(c, region_name=region)
+            output[c] = COLLECTIONS[c].get_collections(session, client, names, get_service_conditions(conditions, c))
+
+    if isinstance(dependencies, dict):
+        for path, uses in dependencies.items():
+            parts = path.split(".")
+            if uses == 1 and len(parts) == 2 and parts[1] in output.get(parts[0], {}) and not is_global(parts[0]):
+                output[parts[0]][parts[1]].keep = False
+
+    return output
+
+def use_snapshot_cache(collections, cache, account, region):
+    """Makes the collections of a region use a SnapshotCache."""
+    for service, names in collections.items():
+        if service not in COLLECTIONS:
+            continue
+
+        for name, coll in names.items():
+            if hasattr(coll, "use_snapshot"):
+                coll.use_snapshot(cache, account, region, "{0}.{1}".format(service, name))
+
+def use_scheduler(collections, scheduler, account, region):
+    """Makes the API calls of the collections of a region wait for the limits of a throttling.Scheduler."""
+    for service, names in collections.items():
+        if service not in COLLECTIONS:
+            continue
+
+        for coll in names.values():
+            if hasattr(coll, "use_scheduler"):
+                coll.use_scheduler(scheduler, (account, region, service))
+
+def use_projections(collections, projections):
+    """Makes the collections of a region keep only the fields read by the query, given as {path: key tuples or None}."""
+    for service, names in collections.items():
+        if service not in COLLECTIONS:
+            continue
+
+        for name, coll in names.items():
+            fields = projections.get("{0}.{1}".format(service, name))
+            if fields is not None and hasattr(coll, "use_projection"):
+                coll.use_projection(fields)
+
+def prefetch_collections(collections, dependencies):
+    """Starts fetching the collections used by a query, for the sources able to fetch in the background."""
+    for path in dependencies:
+        parts = path.split(".")
+        coll = collections.get(parts[0], {}).get(parts[1]) if len(parts) == 2 and parts[0] in COLLECTIONS else None
+        if hasattr(coll, "prefetch"):
+            coll.prefetch()
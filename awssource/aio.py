@@ -0,0 +1,261 @@
+import asyncio
+import contextlib
+import queue
+import sys
+import threading
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+except ImportError:
+    AioConfig = None
+    get_session = None
+
+AVAILABLE = get_session is not None
+
+class AsyncEngine(object):
+    """AsyncEngine runs the STS and API calls as coroutines on an event loop of its own thread.
+
+    The sessions and clients it gives have the interface of the boto3 ones used by the collections,
+    so the LazyListFetchers stay synchronous: their pages are fetched on the loop and buffered as they
+    arrive, up to max_pages per call not read yet. At most max_calls calls of a service are in flight
+    per account, and max_calls calls to STS."""
+
+    def __init__(self, max_calls=16, max_pool_connections=64, max_pages=4):
+        if not AVAILABLE:
+            raise RuntimeError("The async fetch engine requires the aiobotocore package")
+
+        self.max_calls = max_calls
+        self.max_pages = max_pages
+        self.config = AioConfig(max_pool_connections=max_pool_connections, retries={"mode": "adaptive", "max_attempts": 10})
+        self.session = get_session()
+        self.clients = {}
+        self.semaphores = {}
+        self.stack = contextlib.AsyncExitStack()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def run(self, coro):
+        """Runs a coroutine on the loop and waits for its result. Not to be called from the loop."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def semaphore(self, key):
+        # Only used from the loop, no lock needed
+        if key not in self.semaphores:
+            self.semaphores[key] = asyncio.Semaphore(self.max_calls)
+
+        return self.semaphores[key]
+
+    async def client(self, credentials, service, region):
+        key = (credentials["AccessKeyId"] if credentials else None, service, region)
+
+        # Concurrent calls wait for the same client instead of creating their own
+        if key not in self.clients:
+            kwargs = {}
+            if credentials:
+                kwargs = {
+                    "aws_access_key_id": credentials["AccessKeyId"],
+                    "aws_secret_access_key": credentials["SecretAccessKey"],
+                    "aws_session_token": credentials["SessionToken"],
+                }
+
+            context = self.session.create_client(service, region_name=region, config=self.config, **kwargs)
+            self.clients[key] = asyncio.ensure_future(self.stack.enter_async_context(context))
+
+        return await self.clients[key]
+
+    async def assume_role(self, role, cache=None):
+        """Returns an AsyncSession with the credentials of a role and its account id, or None if it can't be assumed."""
+        credentials = cache.get(role) if cache is not None else None
+
+        if credentials is None:
+            try:
+                sts = await self.client(None, "sts", None)
+                async with self.semaphore((None, "sts")):
+                    response = await sts.assume_role(RoleArn=role, RoleSessionName="AWSQL")
+            except Exception as e:
+                sys.stderr.write("Cannot assume role: {0}\n".format(role))
+                sys.stderr.write("-> Reason: {0}\n".format(str(e)))
+                return None
+
+            credentials = response["Credentials"]
+            if cache is not None:
+                cache.put(role, credentials)
+
+        account = role.split(':')[4]
+        return (AsyncSession(self, credentials, account), account)
+
+    def sessions(self, roles, cache=None):
+        """Assumes all the roles concurrently, and returns an object giving their (session, account id) with get(role)."""
+        return AsyncSessions(self, roles, cache)
+
+    async def shutdown(self):
+        # The calls still running (ie. prefetched and never read) are cancelled before their clients are closed
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for t in tasks:
+            t.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.stack.aclose()
+
+    def close(self):
+        self.run(self.shutdown())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+class AsyncSessions(object):
+    def __init__(self, engine, roles, cache=None):
+        self.engine = engine
+        self.futures = {}
+        for role in roles or []:
+            self.futures[role] = asyncio.run_coroutine_threadsafe(engine.assume_role(role, cache), engine.loop)
+
+    def get(self, role):
+        if role is None:
+            return (AsyncSession(self.engine, None, None), None)
+
+        return self.futures[role].result()
+
+class AsyncSession(object):
+    def __init__(self, engine, credentials, account):
+        self.engine = engine
+        self.credentials = credentials
+        self.account = account
+
+    def client(self, service, region_name=None):
+        return AsyncClient(self, service, region_name)
+
+class AsyncClient(object):
+    def __init__(self, session, service, region):
+        self.session = session
+        self.service = service
+        self.region = region
+
+    def get_paginator(self, operation):
+        return AsyncPaginator(self, operation)
+
+    def responses(self, iterate):
+        """Returns the AsyncResponses of the pages yielded by iterate(client), an async generator."""
+        async def pages():
+            client = await self.session.engine.client(self.session.credentials, self.service, self.region)
+            async for page in iterate(client):
+                yield page
+
+        return AsyncResponses(self.session.engine, (self.session.account, self.service), pages)
+
+    def __getattr__(self, operation):
+        return AsyncOperation(self, operation)
+
+class AsyncOperation(object):
+    """AsyncOperation is a single call: called directly it waits for the response, responses() makes it lazy."""
+
+    def __init__(self, client, operation):
+        self.client = client
+        self.operation = operation
+
+    def responses(self, **kwargs):
+        async def iterate(client):
+            yield await getattr(client, self.operation)(**kwargs)
+
+        return self.client.responses(iterate)
+
+    def __call__(self, **kwargs):
+        for response in self.responses(**kwargs):
+            return response
+
+class AsyncPaginator(object):
+    def __init__(self, client, operation):
+        self.client = client
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        def iterate(client):
+            return client.get_paginator(self.operation).paginate(**kwargs)
+
+        return self.client.responses(iterate)
+
+class PageBuffer(object):
+    """PageBuffer passes the pages of a call from the loop to the thread reading them.
+
+    fill() waits on the loop while max_pages pages are waiting to be read."""
+
+    def __init__(self, loop, max_pages):
+        self.loop = loop
+        self.max_pages = max_pages
+        self.queue = queue.Queue()
+        self.space = None
+
+    async def fill(self, engine, key, pages):
+        self.space = asyncio.Semaphore(self.max_pages)
+        iterator = pages().__aiter__()
+
+        try:
+            while True:
+                await self.space.acquire()
+
+                # The call semaphore is only held during the requests, not while the buffer is full
+                async with engine.semaphore(key):
+                    try:
+                        page = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        break
+
+                self.queue.put((True, page))
+        except Exception as e:
+            self.queue.put((False, e))
+            return
+        finally:
+            await iterator.aclose()
+
+        self.queue.put((False, None))
+
+    def get(self):
+        ok, value = self.queue.get()
+        if ok:
+            self.loop.call_soon_threadsafe(self.space.release)
+
+        return ok, value
+
+class AsyncResponses(object):
+    """AsyncResponses iterates the pages of a call made on the loop of an AsyncEngine.
+
+    The call starts with start(), or when the iteration does, and its pages are buffered as they arrive,
+    until max_pages of them are waiting to be read. The call is cancelled when the iteration is closed
+    before its end (ie. by a LIMIT), or when the responses are dropped without being read."""
+
+    def __init__(self, engine, key, pages):
+        self.engine = engine
+        self.key = key
+        self.pages = pages
+        # The call only references the buffer, so that dropping the responses cancels it
+        self.buffer = PageBuffer(engine.loop, engine.max_pages)
+        self.future = None
+
+    def start(self):
+        if self.future is None:
+            self.future = asyncio.run_coroutine_threadsafe(self.buffer.fill(self.engine, self.key, self.pages), self.engine.loop)
+
+        return self
+
+    def cancel(self):
+        if self.future is not None and not self.future.done():
+            self.future.cancel()
+
+    def __iter__(self):
+        self.start()
+
+        try:
+            while True:
+                ok, value = self.buffer.get()
+                if ok:
+                    yield value
+                elif value is None:
+                    return
+                else:
+                    raise value
+        finally:
+            self.cancel()
+
+    def __del__(self):
+        self.cancel()
@@ -0,0 +1,206 @@
+import collections
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".awsql", "cache")
+
+# str() of the datetimes returned by botocore, as written by json.dump(default=str)
+DATE_PATTERN = re.compile(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(\.\d+)?([+-]\d\d:\d\d)?$")
+
+def restore_dates(value):
+    """Converts back, in place, the dates of items loaded from JSON, so that they compare like the fetched ones."""
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return value
+
+    for k, v in items:
+        if isinstance(v, str):
+            # Cheap checks first, most strings aren't dates
+            if len(v) >= 19 and v[4] == "-" and v[10] == " " and DATE_PATTERN.match(v):
+                value[k] = datetime.fromisoformat(v)
+        elif isinstance(v, (dict, list)):
+            restore_dates(v)
+
+    return value
+
+class SnapshotCache(object):
+    """SnapshotCache keeps the items of the collections on disk, keyed by (account, region, collection).
+
+    An entry is served while it's younger than the TTL of its collection (ttls, or the default ttl),
+    unless refresh is set. The least recently used entries are evicted once the cache grows over
+    max_size bytes, down to 90% of it. Dates are stored as strings and restored as datetimes.
+
+    The size of the cache is scanned on the first put, then tracked by the puts: the entries
+    are only scanned again when it goes over max_size."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=300, ttls=None, max_size=512 * 2**20, refresh=False):
+        self.path = path
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.max_size = max_size
+        self.refresh = refresh
+        self.size = None
+        self.lock = threading.Lock()
+
+    def filename(self, account, region, collection, params=None):
+        name = collection
+        if params:
+            digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+            name = "{0}-{1}".format(collection, digest[:10])
+
+        return os.path.join(self.path, str(account), str(region), name + ".json.gz")
+
+    def get(self, account, region, collection, params=None):
+        """Returns the cached items of a collection, or None if they are missing or expired."""
+        if self.refresh:
+            return None
+
+        filename = self.filename(account, region, collection, params)
+        try:
+            mtime = os.stat(filename).st_mtime
+            if time.time() - mtime > self.ttls.get(collection, self.ttl):
+                return None
+
+            with gzip.open(filename, "rt") as fp:
+                data = restore_dates(json.load(fp))
+
+            # The access time orders the entries for the eviction
+            os.utime(filename, (time.time(), mtime))
+        except (OSError, ValueError):
+            return None
+
+        return data
+
+    def put(self, account, region, collection, params, data):
+        filename = self.filename(account, region, collection, params)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        tmp = "{0}.{1}.{2}.tmp".format(filename, os.getpid(), threading.get_ident())
+        with gzip.open(tmp, "wt") as fp:
+            json.dump(data, fp, separators=(",", ":"), default=str)
+
+        try:
+            replaced = os.stat(filename).st_size
+        except OSError:
+            replaced = 0
+
+        size = os.stat(tmp).st_size
+        os.replace(tmp, filename)
+
+        with self.lock:
+            if self.size is not None:
+                self.size += size - replaced
+                if self.size <= self.max_size:
+                    return
+
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in 90% of max_size."""
+        with self.lock:
+            entries = []
+            for root, _, files in os.walk(self.path):
+                for name in files:
+                    if not name.endswith(".json.gz"):
+                        continue
+
+                    filename = os.path.join(root, name)
+                    try:
+                        st = os.stat(filename)
+                    except OSError:
+                        continue
+
+                    entries.append((st.st_atime, st.st_size, filename))
+
+            total = sum(x[1] for x in entries)
+            if total > self.max_size:
+                # Some room is left so that the next puts don't scan the entries again right away
+                for _, size, filename in sorted(entries):
+                    if total <= self.max_size * 0.9:
+                        break
+
+                    try:
+                        os.remove(filename)
+                    except OSError:
+                        pass
+
+                    total -= size
+
+            self.size = total
+
+class RefreshCache(object):
+    """RefreshCache ignores the entries of another cache and writes the fetched items through to it,
+    so that a refreshed query also updates the entries served to the next ones."""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get(self, account, region, collection, params=None):
+        return None
+
+    def put(self, account, region, collection, params, data):
+        self.cache.put(account, region, collection, params, data)
+
+def parse_ttls(value):
+    """Parses "300,ec2.instances=60,iam.roles=3600" into a default TTL and the TTL of each collection."""
+    default = None
+    ttls = {}
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+
+        if "=" in item:
+            collection, ttl = item.split("=", 1)
+            ttls[collection.strip()] = float(ttl)
+        else:
+            default = float(item)
+
+    return default, ttls
+
+class MemoryCache(object):
+    """MemoryCache has the interface of SnapshotCache and keeps the entries in memory, for long running processes.
+
+    The least recently used entries are evicted once there are more than max_entries."""
+
+    def __init__(self, ttl=300, ttls=None, max_entries=1024, refresh=False):
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, account, region, collection, params=None):
+        return (str(account), str(region), collection, json.dumps(params, sort_keys=True, default=str) if params else None)
+
+    def get(self, account, region, collection, params=None):
+        if self.refresh:
+            return None
+
+        key = self.key(account, region, collection, params)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttls.get(collection, self.ttl):
+                return None
+
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, account, region, collection, params, data):
+        key = self.key(account, region, collection, params)
+        with self.lock:
+            self.entries[key] = (time.time(), data)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
@@ -0,0 +1,73 @@
+import collections
+import threading
+import weakref
+from botocore.config import Config
+
+# Enough connections for the workers of a region, kept alive between the pages and the queries
+DEFAULT_CONFIG = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    retries={"mode": "adaptive", "max_attempts": 10},
+)
+
+class ClientPool(object):
+    """ClientPool creates each botocore client once per (credentials, service, region) and reuses it.
+
+    The endpoint resolution, and the connections (with their TLS handshakes) of the clients, are shared
+    by the regions, the accounts using the same credentials and the queries of a process. The least
+    recently used clients (ie. of expired credentials) are dropped once there are more than max_clients."""
+
+    def __init__(self, config=DEFAULT_CONFIG, max_clients=1024):
+        self.config = config
+        self.max_clients = max_clients
+        self.clients = collections.OrderedDict()
+        self.session_locks = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def client(self, session, service, region_name=None):
+        credentials = session.get_credentials()
+        key = (credentials.access_key if credentials is not None else None, service, region_name or session.region_name)
+
+        with self.lock:
+            client = self.get(key)
+            if client is not None:
+                return client
+
+            session_lock = self.session_locks.setdefault(session, threading.Lock())
+
+        # Creating a client loads its service model: only the calls on the same session wait for each other,
+        # since boto3 sessions are not thread safe (the clients created from them are)
+        with session_lock:
+            with self.lock:
+                client = self.get(key)
+                if client is not None:
+                    return client
+
+            client = session.client(service, region_name=region_name, config=self.config)
+
+        with self.lock:
+            self.clients[key] = client
+            while len(self.clients) > self.max_clients:
+                self.clients.popitem(last=False)
+
+            return client
+
+    def get(self, key):
+        # Called with the lock held
+        client = self.clients.get(key)
+        if client is not None:
+            self.clients.move_to_end(key)
+
+        return client
+
+    def session(self, session):
+        """Wraps a boto3 session so that its clients come from the pool."""
+        return PooledSession(self, session)
+
+class PooledSession(object):
+    def __init__(self, pool, session):
+        self.pool = pool
+        self.session = session
+
+    def client(self, service, region_name=None):
+        return self.pool.client(self.session, service, region_name)
@@ -0,0 +1,77 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".awsql", "credentials.json")
+
+def get_expiration(creds):
+    """Returns the expiration of STS credentials as an aware datetime, whether it's one already or an ISO string."""
+    expiration = creds["Expiration"]
+    if not isinstance(expiration, datetime):
+        expiration = datetime.fromisoformat(expiration)
+
+    return expiration if expiration.tzinfo is not None else expiration.replace(tzinfo=timezone.utc)
+
+class CredentialCache(object):
+    """CredentialCache keeps the STS credentials of assumed roles on disk, keyed by role ARN.
+
+    Credentials are served until `margin` seconds before their expiration."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, margin=300):
+        self.path = path
+        self.margin = timedelta(seconds=margin)
+        self.lock = threading.Lock()
+        self.entries = self.read()
+
+    def read(self):
+        try:
+            with open(self.path) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def write(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        # The file contains secrets: only the owner can read it, and it's replaced atomically
+        tmp = "{0}.{1}.tmp".format(self.path, os.getpid())
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as fp:
+            json.dump(self.entries, fp)
+
+        os.replace(tmp, self.path)
+
+    def get(self, role_arn):
+        """Returns the cached credentials of a role, or None if they are missing or about to expire."""
+        with self.lock:
+            creds = self.entries.get(role_arn)
+
+        if creds is None:
+            return None
+
+        try:
+            expiration = get_expiration(creds)
+        except (KeyError, TypeError, ValueError):
+            return None
+
+        if expiration - self.margin <= datetime.now(timezone.utc):
+            return None
+
+        return creds
+
+    def put(self, role_arn, creds):
+        expiration = creds["Expiration"]
+        if isinstance(expiration, datetime):
+            expiration = expiration.isoformat()
+
+        with self.lock:
+            self.entries[role_arn] = {
+                "AccessKeyId": creds["AccessKeyId"],
+                "SecretAccessKey": creds["SecretAccessKey"],
+                "SessionToken": creds["SessionToken"],
+                "Expiration": expiration,
+            }
+            self.write()
@@ -1,16 +1,113 @@
 import boto3
-from .utils import create_list, create_paginated_list
+from .utils import create_list, create_paginated_list, create_filters
 
-def get_collections(session, ec2):
-    return {
-        "instances": create_paginated_list(ec2, 'describe_instances', "Reservations[].Instances[]"),
-        "vpcs": create_list(ec2.describe_vpcs, "Vpcs[]"),
-        "vpns": create_list(ec2.describe_vpn_connections, "VpnConnections[]"),
-        "vpn_gateways": create_list(ec2.describe_vpn_gateways, "VpnGateways[]"),
-        "customer_gateways": create_list(ec2.describe_customer_gateways, "CustomerGateways[]"),
-        "internet_gateways": create_list(ec2.describe_internet_gateways, "InternetGateways[]"),
-        "images": create_list(ec2.describe_images, "Images[]"),
-        "volumes": create_paginated_list(ec2, 'describe_volumes', "Volumes[]"),
-        "subnets": create_list(ec2.describe_subnets, "Subnets[]"),
-        "vpc_endpoints": create_list(ec2.describe_vpc_endpoints, "VpcEndpoints[]")
-    }
\ No newline at end of file
+GLOBAL = False
+
+COLLECTIONS = {
+    "instances": lambda ec2, **kw: create_paginated_list(ec2, 'describe_instances', "Reservations[].Instances[]", **kw),
+    "vpcs": lambda ec2, **kw: create_list(ec2.describe_vpcs, "Vpcs[]", **kw),
+    "vpns": lambda ec2, **kw: create_list(ec2.describe_vpn_connections, "VpnConnections[]", **kw),
+    "vpn_gateways": lambda ec2, **kw: create_list(ec2.describe_vpn_gateways, "VpnGateways[]", **kw),
+    "customer_gateways": lambda ec2, **kw: create_list(ec2.describe_customer_gateways, "CustomerGateways[]", **kw),
+    "internet_gateways": lambda ec2, **kw: create_list(ec2.describe_internet_gateways, "InternetGateways[]", **kw),
+    "images": lambda ec2, **kw: create_list(ec2.describe_images, "Images[]", **kw),
+    "volumes": lambda ec2, **kw: create_paginated_list(ec2, 'describe_volumes', "Volumes[]", **kw),
+    "subnets": lambda ec2, **kw: create_list(ec2.describe_subnets, "Subnets[]", **kw),
+    "vpc_endpoints": lambda ec2, **kw: create_list(ec2.describe_vpc_endpoints, "VpcEndpoints[]", **kw)
+}
+
+# Fields of the items that can be filtered server side, with the name of their API filter
+FILTERS = {
+    "instances": {
+        "InstanceId": "instance-id",
+        "InstanceType": "instance-type",
+        "ImageId": "image-id",
+        "KeyName": "key-name",
+        "State.Name": "instance-state-name",
+        "VpcId": "vpc-id",
+        "SubnetId": "subnet-id",
+        "PrivateIpAddress": "private-ip-address",
+        "PublicIpAddress": "ip-address",
+        "Placement.AvailabilityZone": "availability-zone",
+    },
+    "vpcs": {
+        "VpcId": "vpc-id",
+        "IsDefault": "is-default",
+        "State": "state",
+        "CidrBlock": "cidr",
+        "DhcpOptionsId": "dhcp-options-id",
+        "OwnerId": "owner-id",
+    },
+    "vpns": {
+        "VpnConnectionId": "vpn-connection-id",
+        "State": "state",
+        "Type": "type",
+        "VpnGatewayId": "vpn-gateway-id",
+        "CustomerGatewayId": "customer-gateway-id",
+        "TransitGatewayId": "transit-gateway-id",
+    },
+    "vpn_gateways": {
+        "VpnGatewayId": "vpn-gateway-id",
+        "State": "state",
+        "Type": "type",
+        "AvailabilityZone": "availability-zone",
+    },
+    "customer_gateways": {
+        "CustomerGatewayId": "customer-gateway-id",
+        "State": "state",
+        "Type": "type",
+        "BgpAsn": "bgp-asn",
+        "IpAddress": "ip-address",
+    },
+    "internet_gateways": {
+        "InternetGatewayId": "internet-gateway-id",
+        "OwnerId": "owner-id",
+    },
+    "images": {
+        "ImageId": "image-id",
+        "Name": "name",
+        "State": "state",
+        "OwnerId": "owner-id",
+        "Public": "is-public",
+        "Architecture": "architecture",
+        "ImageType": "image-type",
+        "RootDeviceType": "root-device-type",
+        "VirtualizationType": "virtualization-type",
+    },
+    "volumes": {
+        "VolumeId": "volume-id",
+        "State": "status",
+        "VolumeType": "volume-type",
+        "Encrypted": "encrypted",
+        "SnapshotId": "snapshot-id",
+        "AvailabilityZone": "availability-zone",
+    },
+    "subnets": {
+        "SubnetId": "subnet-id",
+        "VpcId": "vpc-id",
+        "State": "state",
+        "CidrBlock": "cidr-block",
+        "AvailabilityZone": "availability-zone",
+        "DefaultForAz": "default-for-az",
+    },
+    "vpc_endpoints": {
+        "VpcEndpointId": "vpc-endpoint-id",
+        "VpcId": "vpc-id",
+        "ServiceName": "service-name",
+        "VpcEndpointType": "vpc-endpoint-type",
+    },
+}
+
+def get_collections(session, ec2, names=None, conditions=None):
+    output = {}
+    for n, f in COLLECTIONS.items():
+        if names is not None and n not in names:
+            continue
+
+        filters = create_filters(FILTERS.get(n, {}), (conditions or {}).get(n, {}))
+        if filters:
+            output[n] = f(ec2, Filters=filters)
+        else:
+            output[n] = f(ec2)
+
+    return output
@@ -1,9 +1,13 @@
 import boto3
 from .utils import create_list, create_paginated_list
 
-def get_collections(session, iam):
-    return {
-        "roles": create_paginated_list(iam, 'list_roles', "Roles[]"),
-        "users": create_paginated_list(iam, 'list_users', "Users[]"),
-        "groups": create_paginated_list(iam, 'list_groups', "Groups[]"),
-    }
\ No newline at end of file
+GLOBAL = True
+
+COLLECTIONS = {
+    "roles": lambda iam: create_paginated_list(iam, 'list_roles', "Roles[]"),
+    "users": lambda iam: create_paginated_list(iam, 'list_users', "Users[]"),
+    "groups": lambda iam: create_paginated_list(iam, 'list_groups', "Groups[]")
+}
+
+def get_collections(session, iam, names=None, conditions=None):
+    return {n: f(iam) for n, f in COLLECTIONS.items() if names is None or n in names}
@@ -1,7 +1,11 @@
 import boto3
 from .utils import create_list, create_paginated_list
 
-def get_collections(session, r53):
-    return {
-        "hosted_zones": create_paginated_list(r53, 'list_hosted_zones', "HostedZones[]")
-    }
\ No newline at end of file
+GLOBAL = True
+
+COLLECTIONS = {
+    "hosted_zones": lambda r53: create_paginated_list(r53, 'list_hosted_zones', "HostedZones[]")
+}
+
+def get_collections(session, r53, names=None, conditions=None):
+    return {n: f(r53) for n, f in COLLECTIONS.items() if names is None or n in names}
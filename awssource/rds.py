@@ -1,8 +1,12 @@
 import boto3
 from .utils import create_list, create_paginated_list
 
-def get_collections(session, rds):
-    return {
-        "instances": create_paginated_list(rds, 'describe_db_instances', "DBInstances[]"),
-        "subnet_groups": create_paginated_list(rds, 'describe_db_subnet_groups', "DBSubnetGroups[]")
-    }
\ No newline at end of file
+GLOBAL = False
+
+COLLECTIONS = {
+    "instances": lambda rds: create_paginated_list(rds, 'describe_db_instances', "DBInstances[]"),
+    "subnet_groups": lambda rds: create_paginated_list(rds, 'describe_db_subnet_groups', "DBSubnetGroups[]")
+}
+
+def get_collections(session, rds, names=None, conditions=None):
+    return {n: f(rds) for n, f in COLLECTIONS.items() if names is None or n in names}
@@ -0,0 +1,183 @@
+import gzip
+import hashlib
+import json
+import os
+import sys
+from .cache import restore_dates
+
+class MissingRecordingError(Exception):
+    """MissingRecordingError is raised when replaying a call that isn't in the archive."""
+    pass
+
+class Archive(object):
+    """Archive stores the pages returned by the AWS API calls on disk, to run awsql offline.
+
+    Pages are saved as gzipped JSON under <account>/<region>/<service>/<operation>.json.gz.
+    Calls made with parameters (ie. pushed down Filters) get their own file, and replaying
+    them falls back to the unfiltered recording since the conditions are checked locally too.
+    Dates are stored as strings."""
+
+    def __init__(self, path, replay=False):
+        self.path = path
+        self.replay = replay
+
+    def filename(self, account, region, service, operation, kwargs=None):
+        name = operation
+        if kwargs:
+            digest = hashlib.sha1(json.dumps(kwargs, sort_keys=True, default=str).encode()).hexdigest()
+            name = "{0}-{1}".format(operation, digest[:10])
+
+        return os.path.join(self.path, str(account), str(region), service, name + ".json.gz")
+
+    def save(self, account, region, service, operation, kwargs, pages):
+        filename = self.filename(account, region, service, operation, kwargs)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        tmp = "{0}.{1}.tmp".format(filename, os.getpid())
+        with gzip.open(tmp, "wt") as fp:
+            json.dump(pages, fp, separators=(",", ":"), default=str)
+
+        os.replace(tmp, filename)
+
+    def load(self, account, region, service, operation, kwargs=None):
+        for filename in [self.filename(account, region, service, operation, kwargs), self.filename(account, region, service, operation)]:
+            try:
+                # The dates are replayed as datetimes, like botocore returns them
+                with gzip.open(filename, "rt") as fp:
+                    return restore_dates(json.load(fp))
+            except FileNotFoundError:
+                continue
+
+        raise MissingRecordingError("No recording of {0}.{1} for account {2} in {3}".format(service, operation, account, region))
+
+    def session(self, session, account):
+        """Wraps a boto3 session so that its clients record to, or replay from the archive."""
+        return ArchiveSession(self, session, account)
+
+def merge_pages(pages):
+    """Merges the pages of a call into a single response by concatenating their lists."""
+    if not pages:
+        return {}
+
+    response = dict(pages[0])
+    for page in pages[1:]:
+        for k, v in page.items():
+            if isinstance(v, list) and isinstance(response.get(k), list):
+                response[k] = response[k] + v
+
+    return response
+
+class ArchiveSession(object):
+    def __init__(self, archive, session, account):
+        self.archive = archive
+        self.session = session
+        self.account = account
+
+    def client(self, service, region_name=None):
+        from . import COLLECTIONS, is_global
+
+        # The global services give the same data in every region
+        region = region_name
+        if region is None or (service in COLLECTIONS and is_global(service)):
+            region = "global"
+
+        key = (self.account, region, service)
+        if self.archive.replay:
+            return ReplayClient(self.archive, key)
+
+        return RecordingClient(self.archive, key, self.session.client(service, region_name=region_name))
+
+class RecordingClient(object):
+    def __init__(self, archive, key, client):
+        self.archive = archive
+        self.key = key
+        self.client = client
+
+    def get_paginator(self, operation):
+        return RecordingPaginator(self.archive, self.key, operation, self.client.get_paginator(operation))
+
+    def __getattr__(self, operation):
+        func = getattr(self.client, operation)
+
+        def call(**kwargs):
+            response = func(**kwargs)
+            self.archive.save(*self.key, operation, kwargs, [response])
+            return response
+
+        return call
+
+class RecordingPaginator(object):
+    def __init__(self, archive, key, operation, paginator):
+        self.archive = archive
+        self.key = key
+        self.operation = operation
+        self.paginator = paginator
+
+    def paginate(self, **kwargs):
+        pages = []
+        for page in self.paginator.paginate(**kwargs):
+            pages.append(page)
+            yield page
+
+        # Only complete results are saved, not the ones stopped early by a LIMIT
+        self.archive.save(*self.key, self.operation, kwargs, pages)
+
+class ReplayClient(object):
+    def __init__(self, archive, key):
+        self.archive = archive
+        self.key = key
+
+    def get_paginator(self, operation):
+        return ReplayPaginator(self.archive, self.key, operation)
+
+    def __getattr__(self, operation):
+        return lambda **kwargs: merge_pages(self.archive.load(*self.key, operation, kwargs))
+
+class ReplayPaginator(object):
+    def __init__(self, archive, key, operation):
+        self.archive = archive
+        self.key = key
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        return iter(self.archive.load(*self.key, self.operation, kwargs))
+
+def scale_value(value, copy):
+    """Makes the identifiers of a copy of a page unique, keeping the references between them consistent."""
+    if isinstance(value, dict):
+        output = {}
+        for k, v in value.items():
+            if k.endswith("Id") and isinstance(v, str):
+                output[k] = "{0}-{1}".format(v, copy)
+            else:
+                output[k] = scale_value(v, copy)
+
+        return output
+    elif isinstance(value, list):
+        return [scale_value(x, copy) for x in value]
+
+    return value
+
+def scale_archive(source, destination, factor):
+    """Synthesizes a copy of an archive with every recording repeated `factor` times, for load testing."""
+    for root, _, files in os.walk(source):
+        for name in files:
+            if not name.endswith(".json.gz"):
+                continue
+
+            with gzip.open(os.path.join(root, name), "rt") as fp:
+                pages = json.load(fp)
+
+            scaled = [scale_value(p, x) for x in range(factor) for p in pages]
+
+            target = os.path.join(destination, os.path.relpath(root, source))
+            os.makedirs(target, exist_ok=True)
+            with gzip.open(os.path.join(target, name), "wt") as fp:
+                json.dump(scaled, fp, separators=(",", ":"))
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        sys.stderr.write("Usage: python -m awssource.recording SOURCE DESTINATION FACTOR\n")
+        sys.exit(1)
+
+    scale_archive(sys.argv[1], sys.argv[2], int(sys.argv[3]))
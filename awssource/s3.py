@@ -1,7 +1,11 @@
 import boto3
 from .utils import create_list
 
-def get_collections(session, s3):
-    return {
-        "buckets": create_list(s3.list_buckets, "Buckets[]")
-    }
\ No newline at end of file
+GLOBAL = True
+
+COLLECTIONS = {
+    "buckets": lambda s3: create_list(s3.list_buckets, "Buckets[]")
+}
+
+def get_collections(session, s3, names=None, conditions=None):
+    return {n: f(s3) for n, f in COLLECTIONS.items() if names is None or n in names}
@@ -0,0 +1,139 @@
+import threading
+import time
+
+# Error codes of the throttled calls, across the AWS services
+THROTTLING_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "PriorRequestNotComplete",
+    "SlowDown",
+}
+
+def is_throttling(error):
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code") in THROTTLING_CODES
+
+class Limiter(object):
+    """Limiter adapts the calls to an (account, region, service) to its throttling responses.
+
+    Calls wait for a slot under the concurrency limit and for a token of a bucket refilled at `rate`
+    calls per second, up to `burst` tokens. Both grow additively with the successful calls while they
+    hold the calls back (the limit by one per `limit` calls, like a TCP window) and are halved on throttling, at most once per
+    `cooldown` seconds so that the calls throttled together only count once."""
+
+    def __init__(self, limit=8, max_limit=64, rate=20.0, max_rate=200.0, min_rate=0.5, burst=50.0, cooldown=1.0):
+        self.limit = float(limit)
+        self.max_limit = max_limit
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.cooldown = cooldown
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.decreased = 0.0
+        self.in_flight = 0
+        self.cond = threading.Condition()
+        self.stats = {"calls": 0, "throttled": 0, "wait": 0.0}
+
+    def acquire(self):
+        with self.cond:
+            start = time.monotonic()
+            while True:
+                now = time.monotonic()
+                self.tokens = min(max(self.burst, self.rate), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.in_flight < int(self.limit) and self.tokens >= 1:
+                    break
+
+                # Waits for a release, or for the next token
+                self.cond.wait(None if self.in_flight >= int(self.limit) else (1 - self.tokens) / self.rate)
+
+            self.tokens -= 1
+            self.in_flight += 1
+            self.stats["wait"] += now - start
+
+    def release(self, throttled=False, called=True):
+        with self.cond:
+            self.in_flight -= 1
+
+            if not called:
+                # The end of a pagination doesn't call the API
+                self.tokens += 1
+            elif throttled:
+                self.stats["calls"] += 1
+                self.stats["throttled"] += 1
+
+                now = time.monotonic()
+                if now - self.decreased >= self.cooldown:
+                    self.decreased = now
+                    self.limit = max(1.0, self.limit / 2)
+                    self.rate = max(self.min_rate, self.rate / 2)
+                    self.tokens = min(self.tokens, 0.0)
+            else:
+                self.stats["calls"] += 1
+
+                # Only the limits that held the calls back are raised
+                if self.in_flight + 1 >= int(self.limit):
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                if self.tokens < 1:
+                    self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+
+            self.cond.notify_all()
+
+class Scheduler(object):
+    """Scheduler keeps a Limiter per (account, region, service), shared by all the collections and workers."""
+
+    def __init__(self, **defaults):
+        self.defaults = defaults
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def limiter(self, key):
+        with self.lock:
+            if key not in self.limiters:
+                self.limiters[key] = Limiter(**self.defaults)
+
+            return self.limiters[key]
+
+    def call(self, key, func):
+        """Calls func (one API call) once the Limiter of key allows it."""
+        limiter = self.limiter(key)
+        limiter.acquire()
+
+        try:
+            response = func()
+        except StopIteration:
+            limiter.release(called=False)
+            raise
+        except Exception as e:
+            limiter.release(throttled=is_throttling(e))
+            raise
+
+        # botocore retried the call: the throttling errors are hidden in the retries
+        limiter.release(throttled=response.get("ResponseMetadata", {}).get("RetryAttempts", 0) > 0)
+        return response
+
+    def stats(self, account=None, region=None):
+        """Returns the learned limits, of an account and region or of all of them, as {"account/region/service": {...}}."""
+        output = {}
+        with self.lock:
+            limiters = list(self.limiters.items())
+
+        for key, limiter in limiters:
+            if (account is not None and key[0] != account) or (region is not None and key[1] != region):
+                continue
+
+            output["/".join(str(x) for x in key)] = {
+                "limit": int(limiter.limit),
+                "rate": round(limiter.rate, 2),
+                **limiter.stats,
+            }
+
+        return output
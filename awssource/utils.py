@@ -1,37 +1,227 @@
 import jmespath
 import itertools
+import threading
+import time
 
 class LazyList(object):
-    def __init__(self):
+    def __init__(self, keep=True):
         self.loaded = False
+        self.keep = keep
         self.data = []
+        self.lock = threading.Lock()
 
     def load(self):
         raise NotImplementedError()
 
+    def pages(self):
+        raise NotImplementedError()
+
     def __next__(self):
-        if not self.loaded:
-            self.load()
-            self.loaded = True
+        # Lists iterated only once are streamed page by page instead of being kept in memory
+        if not self.loaded and not self.keep:
+            for page in self.pages():
+                yield from page
 
+            return
+
+        self.fetch()
         for x in self.data:
             yield x
 
+    def fetch(self):
+        """Loads and keeps the data if it isn't already."""
+
+        # Lists of global services are shared between the regions running in parallel
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    self.load()
+                    self.loaded = True
+
+        return self
+
     def __iter__(self):
         return next(self)
 
+    def shared(self):
+        """Tells if the items can be referenced outside of the list, and must not be modified."""
+        return False
+
 class LazyListFetcher(LazyList):
-    def __init__(self, provider_func):
-        self.provider_func = provider_func
+    """LazyListFetcher extracts the items at `path` of the API responses given by responses_func.
+
+    The number of pages, items, bytes, retries and the time spent waiting for the API are kept in stats."""
+
+    def __init__(self, responses_func, path, params=None):
+        self.responses_func = responses_func
+        self.path = path
+        self.expression = jmespath.compile(path)
+        self.params = params
+        self.snapshot = None
+        self.scheduler = None
+        self.projection = None
+        self.prefetched = None
+        self.stats = {"pages": 0, "items": 0, "bytes": 0, "retries": 0, "time": 0.0}
         super().__init__()
 
+    def use_snapshot(self, cache, account, region, collection):
+        """Serves the data from a SnapshotCache when it's fresh, and saves it there otherwise."""
+        self.snapshot = (cache, account, region, collection)
+        self.keep = True
+
+    def use_scheduler(self, scheduler, key):
+        """Makes the API calls wait for the throttling.Scheduler limits of key (account, region, service)."""
+        self.scheduler = (scheduler, key)
+
+    def use_projection(self, fields):
+        """Keeps only the given fields (key tuples) of the items, as the pages arrive."""
+        self.projection = projection_tree(fields)
+
+    def project(self, items):
+        return [project(x, self.projection) for x in items]
+
+    def shared(self):
+        # The snapshot caches can keep the whole items, projections are copies
+        return self.snapshot is not None and self.projection is None
+
+    def prefetch(self):
+        """Starts the calls now when the responses support it (ie. awssource.aio), the pages being buffered until they're read."""
+        if self.loaded or self.prefetched is not None or self.snapshot is not None:
+            return
+
+        responses = self.responses_func()
+        if hasattr(responses, "start"):
+            self.prefetched = responses.start()
+
+    def pages(self):
+        if self.prefetched is not None:
+            responses, self.prefetched = iter(self.prefetched), None
+        else:
+            responses = iter(self.responses_func())
+
+        while True:
+            start = time.perf_counter()
+            try:
+                if self.scheduler is not None:
+                    response = self.scheduler[0].call(self.scheduler[1], lambda: next(responses))
+                else:
+                    response = next(responses)
+            except StopIteration:
+                return
+            finally:
+                self.stats["time"] += time.perf_counter() - start
+
+            metadata = response.get("ResponseMetadata", {})
+            page = self.expression.search(response) or []
+
+            self.stats["pages"] += 1
+            self.stats["items"] += len(page)
+            self.stats["retries"] += metadata.get("RetryAttempts", 0)
+            self.stats["bytes"] += int(metadata.get("HTTPHeaders", {}).get("content-length", 0))
+
+            # The snapshots keep the whole items, for the other queries
+            if self.projection is not None and self.snapshot is None:
+                page = self.project(page)
+
+            yield page
+
     def load(self):
-        self.data = self.provider_func()
+        if self.snapshot is not None:
+            cache, account, region, collection = self.snapshot
+
+            data = cache.get(account, region, collection, self.params)
+            if data is not None:
+                self.stats["cached"] = True
+            else:
+                data = list(itertools.chain.from_iterable(self.pages()))
+                cache.put(account, region, collection, self.params, data)
 
-def create_list(func, path):
-    return LazyListFetcher(lambda: jmespath.search(path, func()))
+            self.data = self.project(data) if self.projection is not None else data
+            return
 
-def create_paginated_list(client, action, path):
+        self.data = list(itertools.chain.from_iterable(self.pages()))
+
+class PartitionedList(LazyList):
+    """PartitionedList chains the lists of several accounts/regions without copying them in a single list.
+
+    Every item is tagged with the "account" ({id, region}) of its partition. The items are tagged in place,
+    only the ones shared with a snapshot cache are copied."""
+
+    def __init__(self):
+        self.partitions = []
+        super().__init__()
+
+    def add(self, tag, data):
+        self.partitions.append((tag, data))
+
+    def pages(self):
+        for tag, data in self.partitions:
+            if isinstance(data, LazyList) and data.shared():
+                yield [{**x, "account": tag} for x in data]
+                continue
+
+            page = list(data)
+            for x in page:
+                x["account"] = tag
+
+            yield page
+
+    def load(self):
+        self.data = list(itertools.chain.from_iterable(self.pages()))
+
+def projection_tree(fields):
+    """Converts key tuples to a tree of {key: subtree}, where None keeps the whole value."""
+    tree = {}
+    for keys in sorted(fields, key=len):
+        node = tree
+        for idx, k in enumerate(keys):
+            if k in node and node[k] is None:
+                break
+
+            if idx == len(keys) - 1:
+                node[k] = None
+            else:
+                node = node.setdefault(k, {})
+
+    return tree
+
+def project(item, tree):
+    """Copies the fields of item found in a projection_tree. Values that aren't objects are kept whole."""
+    if not isinstance(item, dict):
+        return item
+
+    output = {}
+    for k, sub in tree.items():
+        if k in item:
+            output[k] = item[k] if sub is None else project(item[k], sub)
+
+    return output
+
+def create_list(func, path, **kwargs):
+    # Clients of the async engine can start the call before the list is iterated
+    if hasattr(func, "responses"):
+        return LazyListFetcher(lambda: func.responses(**kwargs), path, kwargs)
+
+    # The call is made when the list is iterated, like the pages of a paginator
+    def responses():
+        yield func(**kwargs)
+
+    return LazyListFetcher(responses, path, kwargs)
+
+def create_paginated_list(client, action, path, **kwargs):
     paginator = client.get_paginator(action)
-    return LazyListFetcher(lambda: list(paginator.paginate().search(path)))
-    #return LazyListFetcher(lambda: itertools.chain.from_iterable([jmespath.search(path, x) for x in paginator.paginate()))
+    return LazyListFetcher(lambda: paginator.paginate(**kwargs), path, kwargs)
+
+def create_filters(fields, conditions):
+    """Converts the {field: value} equality conditions on known fields to the Filters parameter of the describe calls."""
+    filters = []
+    for field, value in conditions.items():
+        if field not in fields:
+            continue
+
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+
+        filters.append({"Name": fields[field], "Values": [str(value)]})
+
+    return filters
@@ -0,0 +1,259 @@
+"""Benchmarks the parser and the query engine against generated in-memory collections.
+
+Runs the queries in examples/*.awsql and benchmarks/queries/*.awsql for every size, and reports
+the wall time of each stage, the peak memory and the rows/sec. FROM and WHERE are lazy, so their
+time is accounted to the next blocking step (join, group, order, select).
+
+    python benchmarks/bench.py --sizes 1000,10000 --save baseline.json
+    python benchmarks/bench.py --sizes 1000,10000 --compare baseline.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parser
+from parser.lexer import Lexer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUERY_PATTERNS = [
+    os.path.join(ROOT, "examples", "*.awsql"),
+    os.path.join(ROOT, "benchmarks", "queries", "*.awsql"),
+]
+
+INSTANCE_TYPES = ["t3.micro", "t3.large", "m5.large", "m5.xlarge", "c5.2xlarge", "r5.large"]
+STATES = ["running", "running", "running", "stopped", "terminated"]
+ZONES = ["eu-west-1a", "eu-west-1b", "eu-west-1c"]
+
+def tags(name):
+    return [{"Key": "Name", "Value": name}, {"Key": "Env", "Value": "bench"}]
+
+def generate_collections(size, seed=42):
+    """Generates collections shaped like the describe_* results, with `size` instances and volumes.
+
+    The dates are datetimes, as botocore returns them."""
+    rnd = random.Random(seed)
+    num_vpcs = max(1, size // 1000)
+    num_subnets = max(1, size // 100)
+    num_images = max(1, size // 50)
+
+    vpcs = [{
+        "VpcId": "vpc-{0:08x}".format(x),
+        "IsDefault": x == 0,
+        "CidrBlock": "10.{0}.0.0/16".format(x % 256),
+        "State": "available",
+        "Tags": tags("vpc-{0}".format(x)),
+    } for x in range(num_vpcs)]
+
+    subnets = [{
+        "SubnetId": "subnet-{0:08x}".format(x),
+        "VpcId": vpcs[x % num_vpcs]["VpcId"],
+        "AvailabilityZone": ZONES[x % len(ZONES)],
+        "CidrBlock": "10.{0}.{1}.0/24".format(x % 256, x // 256 % 256),
+        "Tags": tags("subnet-{0}".format(x)),
+    } for x in range(num_subnets)]
+
+    images = [{
+        "ImageId": "ami-{0:08x}".format(x),
+        "Name": "image-{0}".format(x),
+        "State": "available",
+        "OwnerId": "123456789012",
+    } for x in range(num_images)]
+
+    instances = []
+    volumes = []
+    for x in range(size):
+        subnet = subnets[rnd.randrange(num_subnets)]
+        instance_id = "i-{0:012x}".format(x)
+
+        instances.append({
+            "InstanceId": instance_id,
+            "InstanceType": rnd.choice(INSTANCE_TYPES),
+            # Some instances use images that aren't in the account anymore
+            "ImageId": "ami-{0:08x}".format(rnd.randrange(num_images + num_images // 10 + 1)),
+            "State": {"Code": 16, "Name": rnd.choice(STATES)},
+            "SubnetId": subnet["SubnetId"],
+            "VpcId": subnet["VpcId"],
+            "LaunchTime": datetime(2020, rnd.randint(1, 12), rnd.randint(1, 28), tzinfo=timezone.utc),
+            "Placement": {"AvailabilityZone": subnet["AvailabilityZone"], "Tenancy": "default"},
+            "PrivateIpAddress": "10.0.{0}.{1}".format(x // 256 % 256, x % 256),
+            "BlockDeviceMappings": [{"DeviceName": "/dev/xvda", "Ebs": {"VolumeId": "vol-{0:012x}".format(x), "Status": "attached"}}],
+            "Tags": tags("instance-{0}".format(x)),
+        })
+
+        volumes.append({
+            "VolumeId": "vol-{0:012x}".format(x),
+            "Size": rnd.choice([8, 20, 100, 500]),
+            "State": "in-use" if rnd.random() < 0.8 else "available",
+            "AvailabilityZone": subnet["AvailabilityZone"],
+            "CreateTime": datetime(2020, rnd.randint(1, 12), rnd.randint(1, 28), rnd.randint(0, 23), tzinfo=timezone.utc),
+            "Attachments": [{"InstanceId": instance_id, "Device": "/dev/xvda", "State": "attached"}],
+        })
+
+    zones = [{
+        "Id": "/hostedzone/Z{0:012d}".format(x),
+        "Name": "zone{0}.example.com.".format(x),
+        "Config": {"PrivateZone": x % 2 == 0},
+    } for x in range(max(1, size // 10))]
+
+    return {
+        "ec2": {
+            "instances": instances,
+            "vpcs": vpcs,
+            "subnets": subnets,
+            "images": images,
+            "volumes": volumes,
+        },
+        "route53": {
+            "hosted_zones": zones,
+        },
+        "account": {
+            "id": "123456789012",
+            "region": "eu-west-1",
+        },
+    }
+
+def load_queries():
+    queries = {}
+    for pattern in QUERY_PATTERNS:
+        for filename in sorted(glob.glob(pattern)):
+            with open(filename) as fp:
+                queries[os.path.splitext(os.path.basename(filename))[0]] = fp.read()
+
+    return queries
+
+def input_rows(steps, collections):
+    """Counts the rows of the collections read by the FROM and JOIN steps."""
+    total = 0
+    for path in parser.BaseInterpreter(steps).dependencies():
+        total += len(parser.Context(collections).var(path) or [])
+
+    return total
+
+def run_query(content, collections):
+    """Runs a query once and returns the time of each stage."""
+    timings = {}
+
+    start = time.perf_counter()
+    list(Lexer(content).tokens())
+    timings["lex"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    steps = parser.Parser(content).parse()
+    timings["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    interpreter = parser.BaseInterpreter(steps)
+    timings["compile"] = time.perf_counter() - start
+
+    context = parser.Context(collections)
+    for idx, (node, step) in enumerate(zip(steps, interpreter.plan)):
+        start = time.perf_counter()
+        step(context)
+        name = "{0}:{1}".format(idx, type(node).__name__.replace("Node", "").lower())
+        timings[name] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = context.query.Result()
+    timings["result"] = time.perf_counter() - start
+
+    return timings, steps, result
+
+def measure(content, collections, repeat):
+    """Returns the best timings over `repeat` runs, and the peak memory of a separate traced run."""
+    best = None
+    for _ in range(repeat):
+        timings, steps, result = run_query(content, collections)
+        if best is None or sum(timings.values()) < sum(best.values()):
+            best = timings
+
+    tracemalloc.start()
+    run_query(content, collections)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = sum(best.values())
+    rows = input_rows(steps, collections)
+
+    return {
+        "stages": best,
+        "total": total,
+        "peak_memory": peak,
+        "input_rows": rows,
+        "output_rows": len(result) if isinstance(result, list) else 1,
+        "rows_per_sec": rows / total if total > 0 else 0,
+    }
+
+def compare(results, baseline, threshold):
+    """Returns the (query, size, baseline, current) whose total time is slower than the baseline by more than threshold."""
+    regressions = []
+    for name, sizes in results.items():
+        for size, current in sizes.items():
+            previous = baseline.get("queries", {}).get(name, {}).get(size)
+            if previous is None:
+                continue
+
+            if current["total"] > previous["total"] * (1 + threshold):
+                regressions.append((name, size, previous["total"], current["total"]))
+
+    return regressions
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmarks the awsql parser and query engine.")
+    p.add_argument("--sizes", dest="sizes", action="store", default="1000,10000,100000,1000000")
+    p.add_argument("--queries", dest="queries", action="store", help="Comma separated names of the queries to run")
+    p.add_argument("--repeat", dest="repeat", type=int, action="store", default=3)
+    p.add_argument("--save", dest="save", action="store", help="Saves the results as a baseline")
+    p.add_argument("--compare", dest="compare", action="store", help="Compares the results to a baseline")
+    p.add_argument("--threshold", dest="threshold", type=float, action="store", default=0.2)
+
+    args = p.parse_args()
+
+    queries = load_queries()
+    if args.queries:
+        names = [x.strip() for x in args.queries.split(",")]
+        queries = {x: queries[x] for x in names}
+
+    results = {}
+    for size in [int(x) for x in args.sizes.split(",")]:
+        collections = generate_collections(size)
+
+        for name, content in queries.items():
+            r = measure(content, collections, args.repeat)
+            results.setdefault(name, {})[str(size)] = r
+
+            stages = " ".join("{0}={1:.4f}".format(k, v) for k, v in r["stages"].items())
+            print("{0:<32} {1:>8} rows  {2:>9.4f}s  {3:>12.0f} rows/s  {4:>8.1f} MiB  {5}".format(
+                name, size, r["total"], r["rows_per_sec"], r["peak_memory"] / 2**20, stages))
+
+    output = {
+        "python": platform.python_version(),
+        "queries": results,
+    }
+
+    if args.save:
+        with open(args.save, "w") as fp:
+            json.dump(output, fp, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+
+        regressions = compare(results, baseline, args.threshold)
+        for name, size, previous, current in regressions:
+            print("REGRESSION {0} ({1} rows): {2:.4f}s -> {3:.4f}s".format(name, size, previous, current))
+
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
-from .interpreter import BaseInterpreter
+from .interpreter import BaseInterpreter, QueryBatch
+from . import evaluation
 from .parser import Parser
 from .query import Query
 from .tree import Context
\ No newline at end of file
@@ -0,0 +1,34 @@
+import functools
+import pickle
+from .interpreter import BaseInterpreter, QueryBatch
+from .parser import Parser
+from .tree import Context
+
+def dump_collections(local_vars):
+    """Serializes the fetched collections of a context for another process.
+
+    The collections are plain lists of dicts by then: pickle keeps them compact and handles the dates."""
+    return pickle.dumps(local_vars, protocol=pickle.HIGHEST_PROTOCOL)
+
+@functools.lru_cache(maxsize=64)
+def load_interpreter(source):
+    """Parses a query, or a batch given as a tuple of (name, query), once per process."""
+    if isinstance(source, str):
+        return BaseInterpreter(Parser(source).parse())
+
+    return QueryBatch({name: BaseInterpreter(Parser(content).parse()) for name, content in source})
+
+def evaluate(source, payload, profile=False):
+    """Runs a query over collections serialized with dump_collections. Meant to run in a process pool."""
+    interpreter = load_interpreter(source)
+    steps = [] if profile else None
+
+    try:
+        result = {"result": interpreter.run(Context(pickle.loads(payload)), steps)}
+    except Exception as e:
+        result = {"error": str(e)}
+
+    if profile:
+        result["steps"] = steps
+
+    return result
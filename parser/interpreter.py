@@ -1,14 +1,366 @@
-from .tree import Node, Context
-from typing import List
+import re
+import time
+import jmespath
+from .tree import Node, Context, row_to_dict, FromNode, JoinNode, WhereNode, GroupByNode, OrderByNode, LimitNode, SelectNode, VarAccessNode, VarConstNode
+from .tokens import EQ
+from collections import Counter
+from enum import Enum
+from typing import Callable, Dict, List
+
+def var_paths(node):
+    """Yields the keys of every VarAccessNode found in the attributes of a node."""
+    if isinstance(node, VarAccessNode):
+        yield node.keys
+    elif isinstance(node, (list, tuple)):
+        for x in node:
+            yield from var_paths(x)
+    elif hasattr(node, "__dict__") and not isinstance(node, Enum):
+        for x in vars(node).values():
+            yield from var_paths(x)
+
+def uses_groups(group: GroupByNode, steps: List[Node]) -> bool:
+    """Tells if the rows of the groups are needed by the steps following a GROUP BY with aggregates."""
+    if not group.aggregates:
+        return True
+
+    pattern = re.compile(r"\b{0}\s*\.\s*group\b".format(re.escape(group.alias)))
+    selected = False
+    for s in steps:
+        if isinstance(s, SelectNode):
+            if not isinstance(s.path, VarConstNode) or pattern.search(s.path.value):
+                return True
+
+            selected = True
+        elif any(keys[:2] == (group.alias, "group") for keys in var_paths(s)):
+            return True
+
+    # Without a select, the groups are part of the result
+    return not selected
+
+def row_schema(node, schema):
+    """Returns the aliases of the slots of the rows after a step, or None when the rows are objects."""
+    if isinstance(node, FromNode):
+        return (node.alias,)
+    elif isinstance(node, GroupByNode):
+        # The groups of rows that are already objects (ie. after a select) are objects too
+        return (node.alias,) if schema is not None else None
+    elif isinstance(node, JoinNode):
+        return schema + (node.alias,) if schema is not None else None
+    elif isinstance(node, SelectNode):
+        return None
+
+    return schema
+
+def convert_rows(step, to_dict):
+    """Wraps the last step of a plan to convert the rows to objects for the result."""
+    def convert(context: Context):
+        step(context)
+        context.query.Select(to_dict)
+
+    return convert
+
+def select_fields(expression, groups=()):
+    """Returns the field paths read by a select expression from the rows, as {alias: set of key tuples}.
+
+    An empty tuple reads the whole item of the alias. Returns None when the whole rows are read, or
+    when the expression can't be analyzed. The rows of the groups (ie. g.group[]) are rows too."""
+    refs = {}
+    whole = [False]
+
+    def record(full):
+        if not full or (full[0] in groups and full[1:] == ("group",)):
+            whole[0] = True
+        elif full[0] not in groups:
+            refs.setdefault(full[0], set()).add(full[1:])
+
+    def chain(node):
+        # The names of the fields leading a field or subexpression node, and the nodes following them
+        if node["type"] == "field":
+            return (node["value"],), []
+        if node["type"] != "subexpression":
+            return (), [node]
+
+        names = []
+        for idx, c in enumerate(node["children"]):
+            if c["type"] != "field":
+                return tuple(names), node["children"][idx:]
+
+            names.append(c["value"])
+
+        return tuple(names), []
+
+    # path is the keys of the current value from the row, or None when it isn't read from the row
+    def walk(node, path):
+        t = node["type"]
+        if t in ("field", "subexpression"):
+            names, rest = chain(node)
+            if path is None:
+                for c in rest:
+                    walk(c, None)
+            elif not rest:
+                record(path + names)
+            else:
+                walk(rest[0], path + names)
+                for c in rest[1:]:
+                    walk(c, None)
+        elif t in ("identity", "current"):
+            if path is not None:
+                record(path)
+        elif t in ("projection", "filter_projection", "value_projection"):
+            left = node["children"][0]
+            if left["type"] == "flatten":
+                left = left["children"][0]
+
+            names, rest = chain(left)
+            full = path + names if path is not None and not rest else None
+            if full is not None and len(full) == 2 and full[0] in groups and full[1] == "group":
+                # The rows of a group are read like the rows of the query
+                for c in node["children"][1:]:
+                    walk(c, ())
+            else:
+                walk(node["children"][0], path)
+                for c in node["children"][1:]:
+                    walk(c, None)
+        elif t == "pipe":
+            walk(node["children"][0], path)
+            walk(node["children"][1], None)
+        elif t == "index_expression":
+            walk(node["children"][0], path)
+        elif t == "function_expression" and node["value"] == "get_tag" and path is not None:
+            # get_tag only reads the Tags of the object
+            names, rest = chain(node["children"][0])
+            if rest:
+                walk(node["children"][0], path)
+            else:
+                record(path + names + ("Tags",))
+
+            for c in node["children"][1:]:
+                walk(c, path)
+        else:
+            for c in node.get("children", []):
+                walk(c, path)
+
+    try:
+        walk(jmespath.compile(expression).parsed, ())
+    except Exception:
+        return None
+
+    return None if whole[0] else refs
+
+def describe_projections(projections):
+    """Formats the projections as {path: sorted dotted fields}, or "*" for the items read whole."""
+    return {p: sorted(".".join(k) for k in keys) if keys is not None else "*" for p, keys in projections.items()}
 
 class BaseInterpreter(object):
     """BaseInterpreter provides the basic features set for running the instructions."""
 
     def __init__(self, steps: List[Node]):
         self.steps = steps
+        self.plan = self.compile(steps)
+
+    def compile(self, steps: List[Node]) -> List[Callable[[Context], None]]:
+        """Compiles the steps once so that the plan can be reused for every context.
+
+        The rows are tuples with a slot per alias until the select, or the result, converts them to objects."""
+        plan = []
+        schema = None
+        for idx, s in enumerate(steps):
+            # An ORDER BY directly followed by a LIMIT only has to keep the first rows
+            if isinstance(s, OrderByNode) and idx + 1 < len(steps) and isinstance(steps[idx + 1], LimitNode):
+                plan.append(s.compile(schema, limit=steps[idx + 1].count))
+            elif isinstance(s, GroupByNode):
+                plan.append(s.compile(schema, keep_groups=uses_groups(s, steps[idx + 1:])))
+            else:
+                plan.append(s.compile(schema))
+
+            schema = row_schema(s, schema)
+
+        if plan and schema is not None:
+            plan[-1] = convert_rows(plan[-1], row_to_dict(schema))
+
+        return plan
+
+    def dependencies(self) -> Counter:
+        """Returns the variable paths of the collections used by the FROM and JOIN steps, with their number of uses."""
+        paths = Counter()
+        for s in self.steps:
+            if isinstance(s, (FromNode, JoinNode)) and isinstance(s.collection, VarAccessNode):
+                paths[s.collection.path] += 1
+
+        return paths
+
+    def conditions(self) -> Dict[str, Dict[str, object]]:
+        """Returns the equality conditions of the WHERE steps on the fields of each collection.
+
+        Only collections used once, and the WHERE steps before any GROUP BY, ORDER BY, LIMIT or SELECT,
+        are considered: the later ones don't filter the items as fetched. The conditions are still checked
+        by the WHERE steps: the sources can use them to filter the data before sending it."""
+        aliases = {}
+        uses = self.dependencies()
+        for s in self.steps:
+            if isinstance(s, (FromNode, JoinNode)) and isinstance(s.collection, VarAccessNode):
+                if uses[s.collection.path] == 1:
+                    aliases[s.alias] = s.collection.path
+
+        output = {}
+        for s in self.steps:
+            if not isinstance(s, (FromNode, JoinNode, WhereNode)):
+                break
 
-    def run(self, context: Context):
+            if not isinstance(s, WhereNode) or s.condition.op != EQ:
+                continue
+
+            lhs, rhs = s.condition.lhs, s.condition.rhs
+            if isinstance(lhs, VarConstNode):
+                lhs, rhs = rhs, lhs
+
+            if not isinstance(lhs, VarAccessNode) or not isinstance(rhs, VarConstNode) or rhs.value is None:
+                continue
+
+            if len(lhs.keys) < 2 or lhs.keys[0] not in aliases:
+                continue
+
+            fields = output.setdefault(aliases[lhs.keys[0]], {})
+            fields.setdefault(".".join(lhs.keys[1:]), rhs.value)
+
+        return output
+
+    def projections(self) -> Dict[str, object]:
+        """Returns the fields of the items of each collection read by the query, as {path: set of key tuples}.
+
+        Collections whose items are read whole (ie. without a select, or with a dynamic one) map to None."""
+        aliases = {}
+        groups = set()
+        for s in self.steps:
+            if isinstance(s, (FromNode, JoinNode)) and isinstance(s.collection, VarAccessNode):
+                aliases.setdefault(s.alias, set()).add(s.collection.path)
+            elif isinstance(s, GroupByNode):
+                groups.add(s.alias)
+
+        fields = {}
+        selected = False
         for s in self.steps:
-            s.resolve(context)
+            if isinstance(s, SelectNode):
+                refs = select_fields(s.path.value, groups) if isinstance(s.path, VarConstNode) else None
+                if refs is None:
+                    return {p: None for p in self.dependencies()}
+
+                for alias, keys in refs.items():
+                    fields.setdefault(alias, set()).update(keys)
+
+                selected = True
+            else:
+                nodes = [v for k, v in vars(s).items() if k != "collection"]
+                for keys in var_paths(nodes):
+                    fields.setdefault(keys[0], set()).add(keys[1:])
+
+        output = {}
+        for alias, paths in aliases.items():
+            keys = fields.get(alias, set())
+            for p in paths:
+                if not selected or () in keys or output.get(p, set()) is None:
+                    output[p] = None
+                else:
+                    output[p] = output.get(p, set()) | keys
+
+        return output
+
+    def explain(self) -> dict:
+        """Describes the planned steps and the collections that will be fetched."""
+        steps = []
+        for idx, s in enumerate(self.steps):
+            description = s.describe()
+            if isinstance(s, OrderByNode) and idx + 1 < len(self.steps) and isinstance(self.steps[idx + 1], LimitNode):
+                description += " (top {0} heap)".format(self.steps[idx + 1].count)
+            elif isinstance(s, GroupByNode) and not uses_groups(s, self.steps[idx + 1:]):
+                description += " (aggregates only)"
+
+            steps.append(description)
+
+        uses = self.dependencies()
+
+        return {
+            "steps": steps,
+            "collections": [{"path": p, "uses": n} for p, n in uses.items()],
+            "filters": self.conditions(),
+            "projections": describe_projections(self.projections()),
+        }
+
+    def run(self, context: Context, profile: List[dict] = None):
+        """Runs the plan. When a profile list is given, the time and rows of every step are appended to it.
+
+        Profiling materializes the rows after each step so that the lazy steps are timed on their own."""
+        if profile is None:
+            for step in self.plan:
+                step(context)
+
+            return context.query.Result()
+
+        rows = None
+        for node, step in zip(self.steps, self.plan):
+            start = time.perf_counter()
+            step(context)
+            result = context.query.materialize()
+            elapsed = time.perf_counter() - start
+
+            rows_out = len(result) if isinstance(result, list) else None
+            profile.append({"step": node.describe(), "time": elapsed, "rows_in": rows, "rows_out": rows_out})
+            rows = rows_out
 
         return context.query.Result()
+
+class QueryBatch(object):
+    """QueryBatch runs several queries against the same collections, which are fetched only once."""
+
+    def __init__(self, interpreters: Dict[str, BaseInterpreter]):
+        self.interpreters = interpreters
+
+    def dependencies(self) -> Counter:
+        """Returns the union of the collections used by the queries, with their total number of uses."""
+        paths = Counter()
+        for i in self.interpreters.values():
+            paths.update(i.dependencies())
+
+        return paths
+
+    def conditions(self) -> Dict[str, Dict[str, object]]:
+        """Returns the conditions that can be used by the sources: the ones on collections used by a single query."""
+        uses = self.dependencies()
+        output = {}
+        for i in self.interpreters.values():
+            for path, fields in i.conditions().items():
+                if uses[path] == 1:
+                    output[path] = fields
+
+        return output
+
+    def projections(self) -> Dict[str, object]:
+        """Returns the union of the fields read by the queries from each collection."""
+        output = {}
+        for i in self.interpreters.values():
+            for path, keys in i.projections().items():
+                if keys is None or output.get(path, set()) is None:
+                    output[path] = None
+                else:
+                    output[path] = output.get(path, set()) | keys
+
+        return output
+
+    def explain(self) -> dict:
+        return {name: i.explain() for name, i in self.interpreters.items()}
+
+    def run(self, context: Context, profile: List[dict] = None):
+        """Runs every query with its own Context sharing the variables of context, and returns {name: {result|error}}."""
+        output = {}
+        for name, i in self.interpreters.items():
+            steps = [] if profile is not None else None
+
+            try:
+                output[name] = {"result": i.run(Context(context.locals), steps)}
+            except Exception as e:
+                output[name] = {"error": str(e)}
+
+            if profile is not None:
+                profile.append({"query": name, "steps": steps})
+
+        return output
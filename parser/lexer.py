@@ -58,7 +58,7 @@ class Lexer(object):
             yield t
 
             if t.type == EOF:
-                raise StopIteration()
+                return
 
 
     def get_next_token(self) -> Token:
@@ -124,6 +124,14 @@ class Lexer(object):
                 self.buf.inc()
                 return self.make_token(RSQB, ']')
 
+            elif c == '(':
+                self.buf.inc()
+                return self.make_token(LPAREN, '(')
+
+            elif c == ')':
+                self.buf.inc()
+                return self.make_token(RPAREN, ')')
+
             elif c == ',':
                 self.buf.inc()
                 return self.make_token(COMMA, ',')
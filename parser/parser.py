@@ -1,7 +1,7 @@
 from .utils import grab, InterpreterError
 from .lexer import Lexer
 from .tree import *
-from .query import JoinDirection, JoinType
+from .query import JoinDirection, JoinType, AGGREGATES
 from .tokens import *
 from typing import Tuple, List
 
@@ -34,16 +34,20 @@ class Parser(object):
         else:
             raise self.error("Expected {0}, got {1}".format(ttype, self.cur_token.type))
 
-    def var_access(self) -> str:
+    def var_access(self, member=False) -> str:
         token = self.cur_token
         path = ""
-        
-        self.eat(IDENTIFIER)   
+
+        # Keywords are valid field names after a dot (ie. rule.Order)
+        if member and token.type in KEYWORDS:
+            self.eat(token.type)
+        else:
+            self.eat(IDENTIFIER)
         path += token.value     
 
         if self.cur_token.type == DOT:
             self.eat(DOT)
-            path += ".{0}".format(self.var_access())
+            path += ".{0}".format(self.var_access(member=True))
 
         return path
 
@@ -125,16 +129,35 @@ class Parser(object):
         
         self.add_step(JoinNode(alias, collection, outer_selector, inner_selector, join_type, join_dir))
 
+    def aggregate(self) -> Tuple[str, str, Node]:
+        token = self.cur_token
+        self.eat(IDENTIFIER)
+        func = token.value.lower()
+
+        if func not in AGGREGATES:
+            raise self.error("Unknown aggregate function: {0}".format(token.value), token.location)
+
+        self.eat(LPAREN)
+        path = None
+        if self.cur_token.type != RPAREN:
+            path = VarAccessNode(self.var_access())
+        elif func != "count":
+            raise self.error("Expected a path for {0}()".format(func))
+        self.eat(RPAREN)
+
+        self.eat(AS)
+        token = self.cur_token
+        self.eat(IDENTIFIER)
+
+        return (token.value, func, path)
+
     def group_stmt(self):
         self.eat(GROUP)
         self.eat(BY)
 
-        key_selectors = []
-        key_paths = []
+        keys = []
         while self.cur_token.type == IDENTIFIER:
-            key_val = self.lvalue()
-            key_paths.append(key_val)
-            key_selectors.append(lambda x: key_val.resolve(x))
+            keys.append(VarAccessNode(self.var_access()))
 
             if self.cur_token.type != COMMA:
                 break
@@ -146,8 +169,55 @@ class Parser(object):
         self.eat(IDENTIFIER)
         alias = token.value
 
-        key_aliases = [x.path.split('.')[-1] for x in key_paths]
-        self.add_step(GroupByNode(alias, key_selectors, key_aliases))
+        aggregates = []
+        if self.cur_token.type == WITH:
+            self.eat(WITH)
+
+            while True:
+                aggregates.append(self.aggregate())
+
+                if self.cur_token.type != COMMA:
+                    break
+                else:
+                    self.eat(COMMA)
+
+        key_aliases = [x.path.split('.')[-1] for x in keys]
+        self.add_step(GroupByNode(alias, keys, key_aliases, aggregates))
+
+    def order_stmt(self):
+        self.eat(ORDER)
+        self.eat(BY)
+
+        keys = []
+        while True:
+            key = VarAccessNode(self.var_access())
+            descending = False
+
+            if self.cur_token.type == DESC:
+                descending = True
+                self.eat(DESC)
+            elif self.cur_token.type == ASC:
+                self.eat(ASC)
+
+            keys.append((key, descending))
+
+            if self.cur_token.type != COMMA:
+                break
+            else:
+                self.eat(COMMA)
+
+        self.add_step(OrderByNode(keys))
+
+    def limit_stmt(self):
+        self.eat(LIMIT)
+
+        token = self.cur_token
+        self.eat(NUMBER)
+
+        if not token.value.isdigit():
+            raise self.error("Expected a positive integer, got {0}".format(token.value), token.location)
+
+        self.add_step(LimitNode(int(token.value)))
 
     def statement(self):
         if self.cur_token.type == FROM:
@@ -158,6 +228,10 @@ class Parser(object):
             self.join_stmt()
         elif self.cur_token.type == GROUP:
             self.group_stmt()
+        elif self.cur_token.type == ORDER:
+            self.order_stmt()
+        elif self.cur_token.type == LIMIT:
+            self.limit_stmt()
         elif self.cur_token.type == SELECT:
             self.select_stmt()
         else:
@@ -1,6 +1,9 @@
-import jmespath
+import functools
+import heapq
+import itertools
+from collections.abc import Iterator
 from enum import Enum
-from .utils import JMESPathFunctions
+from .utils import OPTIONS, compile_expression
 
 class JoinType(Enum):
     INNER = 0
@@ -10,63 +13,230 @@ class JoinDirection(Enum):
     LEFT = 0
     RIGHT = 1
 
+def hash_key(value):
+    """Converts a selector value into something usable as a dictionary key."""
+    if isinstance(value, list):
+        return tuple(hash_key(x) for x in value)
+    elif isinstance(value, dict):
+        return tuple(sorted((k, hash_key(v)) for k, v in value.items()))
+
+    return value
+
+def build_hash_table(rows, selector):
+    """Indexes the position of every row by its join key."""
+    table = {}
+    for idx, row in enumerate(rows):
+        table.setdefault(hash_key(selector(row)), []).append(idx)
+
+    return table
+
+def make_comparer(key_selectors, descending):
+    """Returns a cmp function ordering the rows by their keys, None values coming last in ascending order."""
+
+    def compare(x, y):
+        for selector, desc in zip(key_selectors, descending):
+            a = selector(x)
+            b = selector(y)
+
+            if a == b:
+                continue
+            elif a is None:
+                c = 1
+            elif b is None:
+                c = -1
+            else:
+                try:
+                    c = -1 if a < b else 1
+                except TypeError:
+                    # Values of different types are ordered by type name
+                    c = -1 if type(a).__name__ < type(b).__name__ else 1
+
+            return -c if desc else c
+
+        return 0
+
+    return compare
+
+class Aggregate(object):
+    """Aggregate computes a value over the rows of a group, updated one row at a time."""
+
+    def __init__(self, selector=None):
+        self.selector = selector
+
+    def initial(self):
+        return None
+
+    def update(self, state, row):
+        raise NotImplementedError()
+
+    def result(self, state):
+        return state
+
+class CountAggregate(Aggregate):
+    """Counts the rows, or the rows where the selected value isn't None."""
+
+    def initial(self):
+        return 0
+
+    def update(self, state, row):
+        if self.selector is None or self.selector(row) is not None:
+            return state + 1
+
+        return state
+
+class SumAggregate(Aggregate):
+    def update(self, state, row):
+        value = self.selector(row)
+        if value is None:
+            return state
+
+        return value if state is None else state + value
+
+class MinAggregate(Aggregate):
+    def update(self, state, row):
+        value = self.selector(row)
+        if value is None or (state is not None and state <= value):
+            return state
+
+        return value
+
+class MaxAggregate(Aggregate):
+    def update(self, state, row):
+        value = self.selector(row)
+        if value is None or (state is not None and state >= value):
+            return state
+
+        return value
+
+AGGREGATES = {
+    "count": CountAggregate,
+    "sum": SumAggregate,
+    "min": MinAggregate,
+    "max": MaxAggregate,
+}
+
 class Query(object):
     def __init__(self):
         self.result = None
         pass
 
+    def materialize(self):
+        """Turns the rows streamed by the lazy stages into a list, for the blocking stages."""
+        if isinstance(self.result, Iterator):
+            self.result = list(self.result)
+
+        return self.result
+
     def From(self, source):
-        self.result = list(source)
+        # The rows stay lazy until the first blocking stage (join, path or result)
+        self.result = iter(source)
         return self
 
     def Where(self, predicate):
-        self.result = list(filter(predicate, self.result))
+        self.result = filter(predicate, self.result)
         return self
 
-    def GroupBy(self, keys_selectors, result_func):
+    def GroupBy(self, keys_selectors, result_func, aggregates=None, keep_groups=True):
+        """Groups the rows in a single pass over them.
+
+        aggregates is a list of (name, Aggregate) updated for each row of a group. When keep_groups
+        is False, only the aggregates are kept in memory and not the rows of the groups."""
+        aggregates = aggregates or []
         tmp = {}
 
         for item in self.result:
             key = tuple([s(item) for s in keys_selectors])
-            
-            if key not in tmp:
-                tmp[key] = []
+            hkey = hash_key(key)
+
+            state = tmp.get(hkey)
+            if state is None:
+                state = tmp[hkey] = [key, [] if keep_groups else None] + [a.initial() for _, a in aggregates]
+
+            if keep_groups:
+                state[1].append(item)
+
+            for idx, (_, a) in enumerate(aggregates, 2):
+                state[idx] = a.update(state[idx], item)
+
+        self.result = []
+        for state in tmp.values():
+            values = {name: a.result(state[idx]) for idx, (name, a) in enumerate(aggregates, 2)}
+            self.result.append(result_func(state[0], state[1], values))
 
-        self.result = [result_func(x, y) for x, y in tmp.items()]
         return self
 
-    def Join(self, rhs, lhs_selector, rhs_selector, result_func, join_type=JoinType.INNER, direction=JoinDirection.LEFT):
-        new_result = []
+    def Join(self, rhs, lhs_selector, rhs_selector, result_func, join_type=JoinType.INNER, direction=JoinDirection.LEFT, empty=None):
+        """Joins the rows with rhs. The outer rows without a match are given to result_func with empty ({} by default)."""
+        if empty is None:
+            empty = {}
 
         if join_type == JoinType.OUTER and direction == JoinDirection.RIGHT:
-            outer = rhs
-            inner = self.result
+            outer = list(rhs)
+            inner = self.materialize()
             outer_selector = rhs_selector
             inner_selector = lhs_selector
         else:
-            outer = self.result
-            inner = rhs
+            outer = self.materialize()
+            inner = list(rhs)
             outer_selector = lhs_selector
             inner_selector = rhs_selector
 
-        found = False
-        for o in outer:
-            o_key = outer_selector(o)
-
+        # Build the hash table on the smaller side and probe it with the other one.
+        # Matches are always collected per outer row so the output order does not
+        # depend on the side picked for the build.
+        matches = [[] for _ in outer]
+        if len(outer) <= len(inner):
+            table = build_hash_table(outer, outer_selector)
             for i in inner:
-                if o_key == inner_selector(i):
-                    new_result.append(result_func(o, i))
-                    found = True
+                for idx in table.get(hash_key(inner_selector(i)), ()):
+                    matches[idx].append(i)
+        else:
+            table = build_hash_table(inner, inner_selector)
+            for idx, o in enumerate(outer):
+                matches[idx] = [inner[x] for x in table.get(hash_key(outer_selector(o)), ())]
+
+        new_result = []
+        for o, found in zip(outer, matches):
+            for i in found:
+                new_result.append(result_func(o, i))
 
             if not found and join_type == JoinType.OUTER:
-                new_result.append(result_func(o, {}))
+                new_result.append(result_func(o, empty))
 
         self.result = new_result
         return self
 
+    def OrderBy(self, key_selectors, descending, limit=None):
+        key = functools.cmp_to_key(make_comparer(key_selectors, descending))
+
+        # With a limit only the first rows are kept in a bounded heap instead of sorting everything
+        if limit is None:
+            self.result = sorted(self.result, key=key)
+        else:
+            self.result = heapq.nsmallest(limit, self.result, key=key)
+
+        return self
+
+    def Limit(self, count):
+        # Slicing the lazy stages stops pulling pages from the source once enough rows are found
+        if isinstance(self.result, list):
+            self.result = self.result[:count]
+        else:
+            self.result = itertools.islice(self.result, count)
+
+        return self
+
+    def Select(self, selector):
+        self.result = map(selector, self.result)
+        return self
+
     def Path(self, expr):
-        self.result = jmespath.search(expr, self.result, options=jmespath.Options(custom_functions=JMESPathFunctions()))
+        # expr is an expression compiled with compile_expression, or its text
+        if isinstance(expr, str):
+            expr = compile_expression(expr)
+
+        self.result = expr.search(self.materialize(), options=OPTIONS)
         return self
 
     def Result(self):
-        return self.result
+        return self.materialize()
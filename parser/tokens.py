@@ -15,13 +15,13 @@ EQ, NEQ, GT, LT, GTE, LTE = (
 )
 
 # PUNCTUATION
-DOT, COMMA, LSQB, RSQB, EOF = (
-    'DOT', 'COMMA', 'LSQB', 'RSQB', 'EOF'
+DOT, COMMA, LSQB, RSQB, LPAREN, RPAREN, EOF = (
+    'DOT', 'COMMA', 'LSQB', 'RSQB', 'LPAREN', 'RPAREN', 'EOF'
 )
 
 # KEYWORDS
-FROM, IN, JOIN, INNER, OUTER, LEFT, RIGHT, ON, EQUALS, WHERE, SELECT, GROUP, BY, INTO = (
-    'FROM', 'IN', 'JOIN', 'INNER', 'OUTER', 'LEFT', 'RIGHT', 'ON', 'EQUALS', 'WHERE', 'SELECT', 'GROUP', 'BY', 'INTO'
+FROM, IN, JOIN, INNER, OUTER, LEFT, RIGHT, ON, EQUALS, WHERE, SELECT, GROUP, BY, INTO, ORDER, ASC, DESC, LIMIT, WITH, AS = (
+    'FROM', 'IN', 'JOIN', 'INNER', 'OUTER', 'LEFT', 'RIGHT', 'ON', 'EQUALS', 'WHERE', 'SELECT', 'GROUP', 'BY', 'INTO', 'ORDER', 'ASC', 'DESC', 'LIMIT', 'WITH', 'AS'
 )
 
 KEYWORDS = [
@@ -38,7 +38,13 @@ KEYWORDS = [
     SELECT,
     GROUP,
     BY,
-    INTO
+    INTO,
+    ORDER,
+    ASC,
+    DESC,
+    LIMIT,
+    WITH,
+    AS
 ]
 
 class Token(object):
@@ -1,6 +1,7 @@
-from .query import Query
+import operator
+from .query import Query, JoinType, JoinDirection, AGGREGATES
 from .tokens import EQ, NEQ, LT, GT, LTE, GTE
-from .utils import grab, InterpreterError
+from .utils import grab, compile_path, compile_expression, InterpreterError
 
 class Context:
     """Context is used by the Query Runner and contains the global/local variables."""
@@ -21,10 +22,48 @@ class Context:
         """Get a variable in the current context."""
         return grab(self.locals, path, default=default, raiser=raiser)
 
+OPERATORS = {
+    EQ: operator.eq,
+    NEQ: operator.ne,
+    GT: operator.gt,
+    LT: operator.lt,
+    GTE: operator.ge,
+    LTE: operator.le,
+}
+
+SYMBOLS = {
+    EQ: "==",
+    NEQ: "!=",
+    GT: ">",
+    LT: "<",
+    GTE: ">=",
+    LTE: "<=",
+}
+
+def row_to_dict(schema):
+    """Returns a function converting the rows of a schema (tuples of items, one per alias) to {alias: item}.
+
+    The aliases without an item (ie. in outer joins) are left out."""
+    def convert(row):
+        return {a: x for a, x in zip(schema, row) if x is not None}
+
+    return convert
+
 class Node(object):
     def __init__(self):
         self.loc = None
 
+    def compile(self, schema=None):
+        """Returns a callable doing the work of resolve() with everything static precomputed.
+
+        schema is the tuple of the aliases of the rows, which are tuples holding one item per alias,
+        or None when the rows are objects (ie. after a select)."""
+        raise NotImplementedError()
+
+    def describe(self) -> str:
+        """Returns a short description of the node, for EXPLAIN."""
+        raise NotImplementedError()
+
     def resolve(self, context: Context):
         raise NotImplementedError()
 
@@ -32,28 +71,78 @@ class VarConstNode(object):
     def __init__(self, value):
         self.value = value
 
+    def compile(self, schema=None):
+        value = self.value
+        return lambda x: value
+
+    def describe(self) -> str:
+        return repr(self.value)
+
     def resolve(self, context: Context):
         return self.value
 
 class VarAccessNode(object):
     def __init__(self, path):
         self.path = path
+        self.keys = tuple(path.split("."))
+
+    def compile(self, schema=None):
+        if schema is None:
+            return compile_path(self.keys)
+
+        # The alias is resolved to its slot once, instead of being looked up in every row
+        if self.keys[0] not in schema:
+            return lambda x: None
+
+        idx = schema.index(self.keys[0])
+        if len(self.keys) == 1:
+            return operator.itemgetter(idx)
+
+        getter = compile_path(self.keys[1:])
+
+        def get(row):
+            item = row[idx]
+            return None if item is None else getter(item)
+
+        return get
+
+    def describe(self) -> str:
+        return self.path
 
     def resolve(self, context: Context):
         # Support local resolves like in inner joins
         if isinstance(context, dict):
-            return grab(context, self.path)
+            return grab(context, self.keys)
         else:
-            return context.var(self.path)
+            return context.var(self.keys)
+
+def compile_context_value(node):
+    """Compiles a node that is resolved against the context variables rather than a row."""
+    getter = node.compile()
+
+    if isinstance(node, VarAccessNode):
+        return lambda context: getter(context.locals)
+
+    return getter
 
 class FromNode(object):
     def __init__(self, alias, collection):
         self.alias = alias
         self.collection = collection
 
+    def compile(self, schema=None):
+        collection = compile_context_value(self.collection)
+
+        def step(context: Context):
+            context.query.From((x,) for x in collection(context))
+
+        return step
+
+    def describe(self) -> str:
+        return "FROM {0} IN {1}".format(self.alias, self.collection.describe())
+
     def resolve(self, context: Context):
-        coll = self.collection.resolve(context)
-        context.query.From([{self.alias: x} for x in list(coll)])
+        self.compile()(context)
 
 class ConditionNode(object):
     def __init__(self, lhs, op, rhs):
@@ -61,29 +150,52 @@ class ConditionNode(object):
         self.op = op
         self.rhs = rhs
 
-    def resolve(self, x: Context):
-        if self.op == EQ:
-            return lambda x: self.lhs.resolve(x) == self.rhs.resolve(x)
-        elif self.op == NEQ:
-            return lambda x: self.lhs.resolve(x) != self.rhs.resolve(x)
-        elif self.op == GT:
-            return lambda x: self.lhs.resolve(x) > self.rhs.resolve(x)
-        elif self.op == LT:
-            return lambda x: self.lhs.resolve(x) < self.rhs.resolve(x)
-        elif self.op == GTE:
-            return lambda x: self.lhs.resolve(x) >= self.rhs.resolve(x)
-        elif self.op == LTE:
-            return lambda x: self.lhs.resolve(x) <= self.rhs.resolve(x)
-        else:
+    def compile(self, schema=None):
+        if self.op not in OPERATORS:
             raise Exception("Unknown operation: {0}".format(self.op))
 
+        op = OPERATORS[self.op]
+        lhs = self.lhs.compile(schema)
+        rhs = self.rhs.compile(schema)
+        lhs_const = isinstance(self.lhs, VarConstNode)
+        rhs_const = isinstance(self.rhs, VarConstNode)
+
+        # Fold the constant sides so that only the row accesses are left per row
+        if lhs_const and rhs_const:
+            value = op(self.lhs.value, self.rhs.value)
+            return lambda x: value
+        elif rhs_const:
+            rvalue = self.rhs.value
+            return lambda x: op(lhs(x), rvalue)
+        elif lhs_const:
+            lvalue = self.lhs.value
+            return lambda x: op(lvalue, rhs(x))
+
+        return lambda x: op(lhs(x), rhs(x))
+
+    def describe(self) -> str:
+        return "{0} {1} {2}".format(self.lhs.describe(), SYMBOLS.get(self.op, self.op), self.rhs.describe())
+
+    def resolve(self, x: Context):
+        return self.compile()
+
 class WhereNode(object):
     def __init__(self, condition):
         self.condition = condition
 
+    def compile(self, schema=None):
+        predicate = self.condition.compile(schema)
+
+        def step(context: Context):
+            context.query.Where(predicate)
+
+        return step
+
+    def describe(self) -> str:
+        return "WHERE {0}".format(self.condition.describe())
+
     def resolve(self, context: Context):
-        func = self.condition.resolve(context)
-        context.query.Where(func)
+        self.compile()(context)
 
 class JoinNode(object):
     def __init__(self, alias, collection, outer_selector, inner_selector, join_type, join_dir):
@@ -94,31 +206,153 @@ class JoinNode(object):
         self.join_type = join_type
         self.join_dir = join_dir
 
+    def compile(self, schema=None):
+        alias = self.alias
+        collection = compile_context_value(self.collection)
+        outer_selector = self.outer_selector.compile(schema)
+        join_type = self.join_type
+        join_dir = self.join_dir
+
+        if schema is None:
+            inner_selector = self.inner_selector.compile()
+            wrap = lambda x: {alias: x}
+            result = lambda x, y: {**x, **y}
+            empty = {}
+        else:
+            # The slot of the joined items is appended to the rows, whichever side is the outer one
+            inner_selector = self.inner_selector.compile((alias,))
+            wrap = lambda x: (x,)
+            if join_type == JoinType.OUTER and join_dir == JoinDirection.RIGHT:
+                result = lambda x, y: y + x
+                empty = (None,) * len(schema)
+            else:
+                result = operator.add
+                empty = (None,)
+
+        def step(context: Context):
+            context.query.Join(
+                [wrap(x) for x in collection(context)],
+                outer_selector,
+                inner_selector,
+                result,
+                join_type=join_type,
+                direction=join_dir,
+                empty=empty
+                )
+
+        return step
+
+    def describe(self) -> str:
+        join = "JOIN"
+        if self.join_type == JoinType.OUTER:
+            join = "JOIN OUTER {0}".format(self.join_dir.name if self.join_dir is not None else "LEFT")
+
+        return "{0} {1} IN {2} ON {3} EQUALS {4}".format(join, self.alias, self.collection.describe(), self.outer_selector.describe(), self.inner_selector.describe())
+
     def resolve(self, context: Context):
-        context.query.Join(
-            [{self.alias: x} for x in self.collection.resolve(context)], 
-            lambda x: self.outer_selector.resolve(x), 
-            lambda x: self.inner_selector.resolve(x),
-            lambda x, y: {**x, **y},
-            join_type=self.join_type,
-            direction=self.join_dir
-            )
+        self.compile()(context)
 
 class GroupByNode(object):
-    def __init__(self, alias, key_selectors, key_aliases):
+    def __init__(self, alias, keys, key_aliases, aggregates=None):
         self.alias = alias
-        self.key_selectors = key_selectors
+        self.keys = keys
         self.key_aliases = key_aliases
+        self.aggregates = aggregates or []
+
+    def compile(self, schema=None, keep_groups=True):
+        alias = self.alias
+        key_selectors = [k.compile(schema) for k in self.keys]
+        key_aliases = self.key_aliases
+        aggregates = [(name, AGGREGATES[func](path.compile(schema) if path is not None else None)) for name, func, path in self.aggregates]
+        to_dict = row_to_dict(schema) if schema is not None else None
+
+        def result(key, group, values):
+            output = {**dict(zip(key_aliases, key)), **values}
+            if keep_groups:
+                # The rows of the groups are read by the select as objects
+                output["group"] = group if to_dict is None else [to_dict(x) for x in group]
+
+            return {alias: output} if to_dict is None else (output,)
+
+        def step(context: Context):
+            context.query.GroupBy(key_selectors, result, aggregates, keep_groups)
+
+        return step
+
+    def describe(self) -> str:
+        output = "GROUP BY {0} INTO {1}".format(", ".join(k.describe() for k in self.keys), self.alias)
+        if self.aggregates:
+            output += " WITH {0}".format(", ".join("{0}({1}) AS {2}".format(func, path.describe() if path is not None else "", name) for name, func, path in self.aggregates))
+
+        return output
 
     def resolve(self, context: Context):
-        context.query.GroupBy(self.key_selectors, lambda x, y: {self.alias: { **dict(zip(self.key_aliases, list(x))), "group": y}})
+        self.compile()(context)
+
+class OrderByNode(object):
+    def __init__(self, keys):
+        self.keys = keys
+
+    def compile(self, schema=None, limit=None):
+        key_selectors = [k.compile(schema) for k, _ in self.keys]
+        descending = [d for _, d in self.keys]
+
+        def step(context: Context):
+            context.query.OrderBy(key_selectors, descending, limit)
+
+        return step
+
+    def describe(self) -> str:
+        return "ORDER BY {0}".format(", ".join("{0} {1}".format(k.describe(), "DESC" if d else "ASC") for k, d in self.keys))
+
+    def resolve(self, context: Context):
+        self.compile()(context)
+
+class LimitNode(object):
+    def __init__(self, count):
+        self.count = count
+
+    def compile(self, schema=None):
+        count = self.count
+
+        def step(context: Context):
+            context.query.Limit(count)
+
+        return step
+
+    def describe(self) -> str:
+        return "LIMIT {0}".format(self.count)
+
+    def resolve(self, context: Context):
+        self.compile()(context)
 
 class SelectNode(object):
     def __init__(self, path):
         self.path = path
 
-    def resolve(self, context: Context):
-        context.query.Path("[*].{0}".format(self.path.resolve(context)))
+    def compile(self, schema=None):
+        to_dict = row_to_dict(schema) if schema is not None else None
+
+        if isinstance(self.path, VarConstNode):
+            expr = compile_expression("[*].{0}".format(self.path.value))
+            get_expr = lambda context: expr
+        else:
+            path = compile_context_value(self.path)
+            get_expr = lambda context: "[*].{0}".format(path(context))
+
+        def step(context: Context):
+            if to_dict is not None:
+                context.query.Select(to_dict)
 
+            context.query.Path(get_expr(context))
 
-        
\ No newline at end of file
+        return step
+
+    def describe(self) -> str:
+        if isinstance(self.path, VarConstNode):
+            return "SELECT {0}".format(" ".join(str(self.path.value).split()))
+
+        return "SELECT {0}".format(self.path.describe())
+
+    def resolve(self, context: Context):
+        self.compile()(context)
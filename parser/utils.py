@@ -1,8 +1,12 @@
+import functools
+import jmespath
 from jmespath import functions
 
 
 class JMESPathFunctions(functions.Functions):
-    """Helper methods to add to the JMESPath interpreter."""
+    """Helper methods to add to the JMESPath interpreter.
+
+    A single instance is shared (see OPTIONS): the function table is built once per instance."""
 
     @functions.signature({'types': ['object']}, {'types': ['string']})
     def _func_get_tag(self, data, key):
@@ -16,6 +20,13 @@ class JMESPathFunctions(functions.Functions):
         
         return None
 
+OPTIONS = jmespath.Options(custom_functions=JMESPathFunctions())
+
+@functools.lru_cache(maxsize=1024)
+def compile_expression(expr):
+    """Parses a JMESPath expression once, for all the regions and queries using it."""
+    return jmespath.compile(expr)
+
 
 class InterpreterError(Exception):
     """InterpreterError is an Exception type that contains the location of the error."""
@@ -53,3 +64,23 @@ def grab(data, path, default=None, raiser=False):
     else:
         return obj
 
+
+def compile_path(path, default=None):
+    """Returns a getter equivalent to grab() with the path already split."""
+
+    if isinstance(path, str):
+        keys = tuple(path.split("."))
+    else:
+        keys = tuple(path)
+
+    def getter(data):
+        obj = data
+        for k in keys:
+            if k not in obj:
+                return default
+
+            obj = obj[k]
+
+        return obj
+
+    return getter
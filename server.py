@@ -0,0 +1,170 @@
+import boto3
+import awsql
+import awssource
+import json
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.pool import ThreadPool
+from parser.utils import InterpreterError
+
+class WarmSessions(object):
+    """WarmSessions keeps the sessions of the assumed roles between the queries.
+
+    Roles are assumed again once their credentials expire in less than margin seconds: the credentials
+    given by a credentials cache can be close to their expiration already."""
+
+    def __init__(self, credentials_cache=None, margin=300):
+        self.credentials_cache = credentials_cache
+        self.margin = timedelta(seconds=margin)
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.sts = boto3.client('sts')
+        self.default = boto3.Session()
+
+    def get(self, role):
+        """Returns (session, account id) for a role, or the default session if role is None."""
+        if role is None:
+            return (self.default, None)
+
+        with self.lock:
+            entry = self.sessions.get(role)
+
+        if entry is not None and entry[0] - self.margin > datetime.now(timezone.utc):
+            return entry[1]
+
+        credentials = awsql.get_role_credentials(self.sts, role, self.credentials_cache)
+        if credentials is None:
+            return None
+
+        sess = awsql.role_session(role, credentials)
+        with self.lock:
+            self.sessions[role] = (awssource.credentials.get_expiration(credentials), sess)
+
+        return sess
+
+class QueryServer(ThreadingHTTPServer):
+    """QueryServer runs the queries posted to /query on shared sessions, clients, caches, worker pools and API limits."""
+
+    daemon_threads = True
+
+    def __init__(self, address, workers=8, ttl=300, ttls=None, credentials_cache=None, archive=None):
+        super().__init__(address, QueryHandler)
+        self.archive = archive
+        # The learned limits are kept between the queries
+        self.scheduler = awssource.throttling.Scheduler() if archive is None or not archive.replay else None
+        self.sessions = WarmSessions(credentials_cache)
+        self.clients = awssource.clients.ClientPool()
+        self.snapshots = awssource.cache.MemoryCache(ttl, ttls)
+        self.pools = (ThreadPool(workers), ThreadPool(workers))
+        self.workers = workers
+
+    def server_close(self):
+        super().server_close()
+        for pool in self.pools:
+            pool.close()
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """QueryHandler answers:
+
+    GET /health
+    POST /query {"query": "...", "regions": [...] | "all", "roles": [...], "merge": false,
+                 "profile": false, "with_alias": false, "with_identity": false, "refresh": false}
+
+    The results of /query are streamed as NDJSON, one line per account/region as soon as it completes."""
+
+    def send_json(self, status, value):
+        body = json.dumps(value).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path != "/query":
+            self.send_json(404, {"error": "Not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            self.send_json(400, {"error": "Invalid request: {0}".format(str(e))})
+            return
+
+        if not isinstance(request, dict):
+            self.send_json(400, {"error": "Invalid request: expected a JSON object"})
+            return
+
+        snapshots = self.server.snapshots
+        if request.get("refresh"):
+            snapshots = awssource.cache.RefreshCache(snapshots)
+
+        interpreter = awsql.AWSQLInterpreter(
+            with_identity=request.get("with_identity", False),
+            with_alias=request.get("with_alias", False),
+            profile=request.get("profile", False),
+            archive=self.server.archive,
+            snapshots=snapshots,
+            sessions=self.server.sessions,
+            pools=self.server.pools,
+            scheduler=self.server.scheduler,
+            clients=self.server.clients)
+
+        try:
+            interpreter.load(request.get("query", ""))
+        except InterpreterError as e:
+            self.send_json(400, {"error": str(e), "line": e.lineno, "offset": e.offset})
+            return
+        except Exception as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        regions = request.get("regions")
+        if regions is None:
+            regions = [boto3.Session().region_name]
+        elif regions == "all":
+            regions = awsql.get_all_regions()
+
+        roles = request.get("roles")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+
+        if request.get("merge"):
+            self.write_line(interpreter.run_merged(regions, roles=roles, workers=self.server.workers))
+            return
+
+        for _, task, _, result in interpreter.stream(regions, roles=roles, workers=self.server.workers):
+            line = {"account": task.account_id, **result}
+            if task.meta:
+                line["meta"] = task.meta
+
+            if task.profile:
+                line["account_profile"] = task.timings
+
+            self.write_line(line)
+
+    def write_line(self, value):
+        self.wfile.write((json.dumps(value, default=str) + "\n").encode())
+        self.wfile.flush()
+
+def serve(address, workers=8, ttl=300, ttls=None, credentials_cache=None, archive=None):
+    server = QueryServer(address, workers, ttl, ttls, credentials_cache, archive)
+    sys.stderr.write("Listening on {0}:{1}\n".format(*server.server_address))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()